@@ -0,0 +1,128 @@
+"""Sales analytics backed by a daily rollup collection.
+
+Every purchase request line contributes to one ``sales_daily`` document keyed
+by (day, product, status); single-product requests are their own only line.
+The request routes keep the rollup current with ``$inc`` as requests are
+created, completed or rejected, so reports only read the small rollup instead
+of scanning ``purchase_requests``. ``rebuild_rollup`` recomputes it from
+scratch with a ``$merge`` aggregation (backfill / repair).
+"""
+from datetime import datetime
+from typing import Optional
+
+from pymongo import UpdateOne
+
+from stock import purchase_lines
+
+GROUP_FIELDS = {
+    "day": "$day",
+    "product": "$product_id",
+    "category": "$category",
+    "status": "$status",
+}
+
+def _day(created_at) -> str:
+    if isinstance(created_at, datetime):
+        return created_at.date().isoformat()
+    return created_at[:10]
+
+def _rollup_update(day: str, line: dict, status: str, sign: int) -> UpdateOne:
+    return UpdateOne(
+        {"_id": {"day": day, "product_id": line["product_id"], "status": status}},
+        {
+            "$inc": {
+                "revenue": sign * line["total_price"],
+                "units": sign * line["quantity"],
+                "requests": sign,
+            },
+            "$set": {
+                "product_name": line.get("product_name"),
+                "category": line.get("category"),
+            },
+            "$setOnInsert": {"day": day, "product_id": line["product_id"], "status": status},
+        },
+        upsert=True,
+    )
+
+async def record_created(repo, purchase: dict):
+    """Count a new purchase request in the rollup"""
+    day = _day(purchase["created_at"])
+    status = purchase.get("status", "pending")
+    await repo.sales_daily.bulk_write(
+        [_rollup_update(day, line, status, 1) for line in purchase_lines(purchase)], ordered=False
+    )
+
+async def record_transition(repo, purchase: dict, from_status: str, to_status: str):
+    """Move a purchase request between status buckets of its day"""
+    if from_status == to_status:
+        return
+    day = _day(purchase["created_at"])
+    operations = []
+    for line in purchase_lines(purchase):
+        operations.append(_rollup_update(day, line, from_status, -1))
+        operations.append(_rollup_update(day, line, to_status, 1))
+    await repo.sales_daily.bulk_write(operations, ordered=False)
+
+async def rebuild_rollup(repo):
+    """Recompute the whole rollup from purchase_requests and their archive"""
+    await repo.sales_daily.delete_many({})
+    pipeline = [
+        # Archived requests still count towards historical sales
+        {"$unionWith": {"coll": repo.purchase_requests_archive.name}},
+        {"$addFields": {"line": {"$ifNull": ["$items", ["$$ROOT"]]}}},
+        {"$unwind": "$line"},
+        {"$group": {
+            "_id": {
+                "day": {"$substrCP": ["$created_at", 0, 10]},
+                "product_id": "$line.product_id",
+                "status": {"$ifNull": ["$status", "pending"]},
+            },
+            "product_name": {"$last": "$line.product_name"},
+            "category": {"$last": "$line.category"},
+            "revenue": {"$sum": "$line.total_price"},
+            "units": {"$sum": "$line.quantity"},
+            "requests": {"$sum": 1},
+        }},
+        {"$addFields": {"day": "$_id.day", "product_id": "$_id.product_id", "status": "$_id.status"}},
+        {"$merge": {"into": repo.sales_daily.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+    await repo.purchase_requests.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+async def query(repo, group_by: str, start: Optional[str] = None, end: Optional[str] = None,
+                status: Optional[str] = None) -> dict:
+    """Aggregate the rollup over a day range, grouped by day/product/category/status"""
+    match = {}
+    if start or end:
+        match["day"] = {}
+        if start:
+            match["day"]["$gte"] = start
+        if end:
+            match["day"]["$lte"] = end
+    if status:
+        match["status"] = status
+
+    group = {
+        "_id": GROUP_FIELDS[group_by],
+        "revenue": {"$sum": "$revenue"},
+        "units": {"$sum": "$units"},
+        "requests": {"$sum": "$requests"},
+    }
+    if group_by == "product":
+        group["product_name"] = {"$last": "$product_name"}
+
+    pipeline = [
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+    rows = await repo.sales_daily.aggregate(pipeline, maxTimeMS=repo.max_time_ms).to_list(None)
+
+    totals = {"revenue": 0.0, "units": 0, "requests": 0}
+    for row in rows:
+        row[group_by] = row.pop("_id")
+        row["revenue"] = round(row["revenue"], 2)
+        for key in totals:
+            totals[key] += row[key]
+    totals["revenue"] = round(totals["revenue"], 2)
+
+    return {"group_by": group_by, "start": start, "end": end, "status": status, "rows": rows, "totals": totals}
@@ -0,0 +1,84 @@
+"""Archival tier for finished requests.
+
+Completed, rejected and expired requests older than ``ARCHIVE_AFTER_DAYS`` are moved, in
+batches, from the hot request collections into ``<collection>_archive`` so the
+hot collections and their indexes stay small. Each batch is copied with
+idempotent upserts before being deleted, so an interrupted run is safe to repeat.
+"""
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo import ReplaceOne
+
+FINISHED_STATUSES = ["completed", "rejected", "expired"]
+
+# API name -> hot collection attribute on the repository
+REQUEST_KINDS = {
+    "purchase": "purchase_requests",
+    "out-of-stock": "out_of_stock_requests",
+    "custom": "custom_requests",
+}
+
+def archive_after_days() -> int:
+    return int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+
+def batch_size() -> int:
+    return int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+
+def archive_of(repo, kind: str):
+    return getattr(repo, f"{REQUEST_KINDS[kind]}_archive")
+
+async def archive_collection(repo, kind: str, cutoff: str, size: int) -> int:
+    """Move finished requests created before ``cutoff`` into the archive; returns how many moved"""
+    hot = getattr(repo, REQUEST_KINDS[kind])
+    archive = archive_of(repo, kind)
+    query = {"status": {"$in": FINISHED_STATUSES}, "created_at": {"$lt": cutoff}}
+    archived_at = datetime.now(timezone.utc).isoformat()
+
+    moved = 0
+    while True:
+        batch = await hot.find(query, {"_id": 0}).sort("created_at", 1).limit(size).to_list(size)
+        if not batch:
+            break
+
+        await archive.bulk_write(
+            [ReplaceOne({"id": doc["id"]}, {**doc, "archived_at": archived_at}, upsert=True) for doc in batch],
+            ordered=False
+        )
+        await hot.delete_many({"id": {"$in": [doc["id"] for doc in batch]}})
+
+        moved += len(batch)
+        if len(batch) < size:
+            break
+    return moved
+
+async def run_archiver(repo, days: Optional[int] = None) -> dict:
+    """Archive every request kind; used by the scheduler and the admin trigger"""
+    days = archive_after_days() if days is None else days
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    size = batch_size()
+    return {kind: await archive_collection(repo, kind, cutoff, size) for kind in REQUEST_KINDS}
+
+async def query_archive(repo, kind: str, status: Optional[str] = None, start: Optional[str] = None,
+                        end: Optional[str] = None, skip: int = 0, limit: int = 100) -> dict:
+    """Page through archived requests, newest first"""
+    query = {}
+    if status:
+        query["status"] = status
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+
+    archive = archive_of(repo, kind)
+    items = await archive.find(query, {"_id": 0}, max_time_ms=repo.max_time_ms) \
+        .sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    if query:
+        total = await archive.count_documents(query, maxTimeMS=repo.max_time_ms)
+    else:
+        # An unfiltered count_documents scans the whole archive; collection metadata is enough here
+        total = await archive.estimated_document_count(maxTimeMS=repo.max_time_ms)
+    return {"items": items, "total": total, "skip": skip, "limit": limit}
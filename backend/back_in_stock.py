@@ -0,0 +1,155 @@
+"""Back-in-stock notifications for out-of-stock requests.
+
+When an admin raises a product's stock, every pending out-of-stock request for
+that product whose quantity is now available is found with one query on the
+(product_id, status) index. Each phone gets one WhatsApp message, sent in
+batches of ``NOTIFY_BATCH_SIZE`` at no more than ``NOTIFY_RATE_PER_SECOND``
+messages per second through one pooled HTTP client. The requests that were
+notified are then marked ``notified`` with one ``bulk_write``. Staff still
+complete them from the dashboard.
+
+Without ``WHATSAPP_API_URL`` the sender is a mock that only logs, like the
+verification codes.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+from pymongo import UpdateOne
+
+import metrics
+from logging_setup import log_event
+
+logger = logging.getLogger(__name__)
+
+def batch_size() -> int:
+    return max(1, int(os.environ.get('NOTIFY_BATCH_SIZE', '50')))
+
+def rate_per_second() -> float:
+    return float(os.environ.get('NOTIFY_RATE_PER_SECOND', '10'))
+
+class WhatsAppSender:
+    """Sends messages over one keep-alive connection pool (created on first use)"""
+
+    def __init__(self, api_url: Optional[str] = None, token: Optional[str] = None, pool_size: Optional[int] = None):
+        self.api_url = api_url if api_url is not None else os.environ.get('WHATSAPP_API_URL', '')
+        self.token = token if token is not None else os.environ.get('WHATSAPP_API_TOKEN', '')
+        self.pool_size = pool_size or int(os.environ.get('NOTIFY_POOL_SIZE', '10'))
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=10,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                headers={"Authorization": f"Bearer {self.token}"} if self.token else None,
+            )
+        return self._client
+
+    async def send(self, phone: str, message: str) -> bool:
+        if not self.api_url:
+            # Mock WhatsApp: the message only appears in the server logs
+            log_event(logger, "back_in_stock_message", channel="mock_whatsapp", phone=phone, message=message)
+            return True
+        try:
+            response = await self._http().post(self.api_url, json={"to": phone, "message": message})
+            response.raise_for_status()
+            return True
+        except httpx.HTTPError as e:
+            log_event(logger, "back_in_stock_send_failed", logging.WARNING, phone=phone, error=str(e))
+            return False
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class BackInStockNotifier:
+    def __init__(self, repo, sender: Optional[WhatsAppSender] = None):
+        self.repo = repo
+        self.sender = sender or WhatsAppSender()
+        self._jobs: Dict[str, asyncio.Task] = {}
+        self._rerun = set()
+
+    def enqueue(self, product_id: str):
+        """Start a fan-out for ``product_id``; if one is running, run once more after it"""
+        if product_id in self._jobs:
+            self._rerun.add(product_id)
+            return
+        task = asyncio.get_running_loop().create_task(self._run(product_id))
+        self._jobs[product_id] = task
+        task.add_done_callback(lambda _: self._finished(product_id))
+
+    def _finished(self, product_id: str):
+        self._jobs.pop(product_id, None)
+        if product_id in self._rerun:
+            self._rerun.discard(product_id)
+            self.enqueue(product_id)
+
+    async def drain(self, timeout: float):
+        if self._jobs:
+            await asyncio.wait(list(self._jobs.values()), timeout=timeout)
+        await self.sender.close()
+
+    async def _run(self, product_id: str):
+        try:
+            await self.notify(product_id)
+        except Exception as e:
+            log_event(logger, "back_in_stock_failed", logging.ERROR, product_id=product_id, error=str(e))
+
+    async def notify(self, product_id: str) -> dict:
+        """Notify everyone waiting for ``product_id``; returns requests and messages sent"""
+        started = time.perf_counter()
+        product = await self.repo.products.find_one({"id": product_id}, {"_id": 0, "name": 1, "stock": 1})
+        if not product or product.get("stock", 0) <= 0:
+            return {"notified": 0, "messages": 0}
+
+        waiting = await self.repo.out_of_stock_requests.find(
+            {"product_id": product_id, "status": "pending", "quantity": {"$lte": product["stock"]}},
+            {"_id": 0, "id": 1, "phone": 1}
+        ).to_list(None)
+        if not waiting:
+            return {"notified": 0, "messages": 0}
+
+        # One message per phone, however many requests it made
+        by_phone: Dict[str, List[str]] = {}
+        for request in waiting:
+            by_phone.setdefault(request["phone"], []).append(request["id"])
+
+        message = f"¡Buenas noticias! {product['name']} ya está disponible de nuevo. Escríbenos para apartarlo."
+        phones = list(by_phone)
+        size = batch_size()
+        notified: List[str] = []
+        sent = 0
+        for start in range(0, len(phones), size):
+            batch = phones[start:start + size]
+            batch_started = time.perf_counter()
+            results = await asyncio.gather(*[self.sender.send(phone, message) for phone in batch])
+            notified.extend(request_id for phone, ok in zip(batch, results) if ok for request_id in by_phone[phone])
+            sent += sum(results)
+            # Hold the batch to the configured rate before starting the next one
+            if start + size < len(phones):
+                await asyncio.sleep(max(0.0, len(batch) / rate_per_second() - (time.perf_counter() - batch_started)))
+
+        if notified:
+            now = datetime.now(timezone.utc).isoformat()
+            await self.repo.out_of_stock_requests.bulk_write(
+                [
+                    UpdateOne({"id": request_id, "status": "pending"}, {"$set": {"status": "notified", "notified_at": now}})
+                    for request_id in notified
+                ],
+                ordered=False
+            )
+
+        metrics.inc("back_in_stock_messages", sent)
+        metrics.inc("back_in_stock_requests_notified", len(notified))
+        log_event(
+            logger, "back_in_stock_fanout",
+            product_id=product_id, requests=len(notified), messages=sent, failed=len(phones) - sent,
+            duration_ms=round((time.perf_counter() - started) * 1000, 2)
+        )
+        return {"notified": len(notified), "messages": sent}
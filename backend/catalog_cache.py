@@ -0,0 +1,28 @@
+"""Per-worker cache for data derived from the product catalog.
+
+Product write routes call ``invalidate()``; entries also expire after a short
+TTL so writes made through other workers become visible without coordination.
+"""
+import time
+from typing import Any, Optional
+
+class CatalogCache:
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self):
+        self._entries.clear()
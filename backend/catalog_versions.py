@@ -0,0 +1,113 @@
+"""Change versions for incremental catalog sync.
+
+Every product write sets ``version`` (from a global monotonically increasing
+counter) and ``changed_at`` on the documents it touches; deletions leave a
+tombstone with the same fields. Clients keep a local copy and ask only for what
+changed since the last version they saw.
+
+Public clients only see visible products. Hidden products are left out of
+their changes entirely, so drafts never reach them, not even as ids; hiding a
+product that was visible leaves a ``hidden`` tombstone instead, which makes
+public clients drop it and is removed again if the product is shown again.
+Admin clients get hidden products as regular upserts and skip those tombstones.
+
+Each written document gets its own version, so versions never repeat across
+documents and pages split cleanly. Versions are applied with ``$max`` so a
+document's version never goes backwards. A version is allocated just before the
+write that uses it, so a write holding a lower version may become visible after
+one holding a higher version; the sync cursor therefore only advances past
+changes older than ``SETTLE_SECONDS``. Newer ones are sent again on the next
+sync (clients apply changes as upserts, so repeats are harmless).
+"""
+from datetime import datetime, timezone, timedelta
+from typing import List
+
+from pymongo import ReturnDocument, UpdateOne
+
+COUNTER_ID = "catalog_version"
+SETTLE_SECONDS = 5
+
+async def next_stamps(repo, count: int) -> List[dict]:
+    """Allocate ``count`` consecutive versions, one per document about to be written"""
+    counter = await repo.counters.find_one_and_update(
+        {"_id": COUNTER_ID},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    changed_at = datetime.now(timezone.utc).isoformat()
+    first = counter["seq"] - count + 1
+    return [{"version": first + i, "changed_at": changed_at} for i in range(count)]
+
+async def next_stamp(repo) -> dict:
+    return (await next_stamps(repo, 1))[0]
+
+def stamped(update: dict, stamp: dict) -> dict:
+    """Add a version stamp to an update document"""
+    return {**update, "$max": stamp}
+
+async def current_version(repo) -> int:
+    counter = await repo.counters.find_one({"_id": COUNTER_ID})
+    return counter["seq"] if counter else 0
+
+async def stamp_unversioned(repo) -> int:
+    """Give products written before versions existed a version (startup migration)"""
+    unversioned = await repo.products.find({"version": None}, {"_id": 0, "id": 1}).to_list(None)
+    if not unversioned:
+        return 0
+    stamps = await next_stamps(repo, len(unversioned))
+    await repo.products.bulk_write(
+        [UpdateOne({"id": p["id"]}, stamped({}, stamp)) for p, stamp in zip(unversioned, stamps)],
+        ordered=False
+    )
+    return len(unversioned)
+
+async def add_tombstone(repo, product_id: str, stamp: dict, hidden: bool = False):
+    """Record a deleted product, or with ``hidden`` one that left the public catalog"""
+    update = {"$set": {"id": product_id, **stamp}}
+    if hidden:
+        update["$set"]["hidden"] = True
+    else:
+        update["$unset"] = {"hidden": ""}
+    await repo.product_tombstones.update_one({"id": product_id}, update, upsert=True)
+
+async def remove_hidden_tombstone(repo, product_id: str):
+    """The product is visible again: its next version reaches public clients as an upsert"""
+    await repo.product_tombstones.delete_one({"id": product_id, "hidden": True})
+
+def _next_cursor(since: int, changes: List[dict]) -> int:
+    """Highest version the client can safely resume from"""
+    settled_before = (datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS)).isoformat()
+    unsettled = [c["version"] for c in changes if c.get("changed_at", "") >= settled_before]
+    if unsettled:
+        return max(since, min(unsettled) - 1)
+    return max([since] + [c["version"] for c in changes])
+
+async def changes_since(repo, since: int, include_hidden: bool, limit: int = 500) -> dict:
+    """Products upserted and deleted after version ``since``, at most ``limit`` of each"""
+    query = {"version": {"$gt": since}}
+    products = await repo.find(repo.catalog, query, sort=[("version", 1)], limit=limit)
+    # Admins get hidden products as upserts, so their hide tombstones are not deletions
+    tombstone_query = {**query, "hidden": {"$ne": True}} if include_hidden else query
+    tombstones = await repo.find(repo.product_tombstones, tombstone_query, sort=[("version", 1)], limit=limit)
+
+    # A full page may hide later changes: only answer up to the lowest last version of a full page
+    bound = None
+    for page in (products, tombstones):
+        if len(page) == limit:
+            bound = page[-1]["version"] if bound is None else min(bound, page[-1]["version"])
+    if bound is not None:
+        products = [p for p in products if p["version"] <= bound]
+        tombstones = [t for t in tombstones if t["version"] <= bound]
+
+    # Hidden products never reach public clients; the ones they had come as hide tombstones
+    upserted = [p for p in products if include_hidden or p.get("is_visible", True)]
+    deleted = [t["id"] for t in tombstones]
+
+    return {
+        "since": since,
+        "version": _next_cursor(since, products + tombstones),
+        "upserted": upserted,
+        "deleted": deleted,
+        "has_more": bound is not None,
+    }
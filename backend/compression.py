@@ -0,0 +1,239 @@
+"""Response compression.
+
+``CompressionMiddleware`` compresses responses above ``COMPRESSION_MIN_SIZE``
+bytes with brotli when the client accepts it and the optional ``brotli``
+package is installed, and with gzip otherwise. Responses that already carry a
+``Content-Encoding`` (see ``PrecompressedBody``) or an already compressed media
+type pass through untouched.
+
+``PrecompressedBody`` holds a cacheable payload (the public catalog) and
+compresses it once per encoding, at a higher level than per-response
+compression can afford, off the event loop.
+"""
+import asyncio
+import os
+import time
+import zlib
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+INCOMPRESSIBLE_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip", "font/woff")
+
+def min_size() -> int:
+    return int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+
+def static_level(encoding: str) -> int:
+    """Level for bodies compressed once and reused (catalog, upload sidecars)"""
+    if encoding == "br":
+        return int(os.environ.get('COMPRESSION_STATIC_BROTLI_QUALITY', '9'))
+    return int(os.environ.get('COMPRESSION_STATIC_GZIP_LEVEL', '9'))
+
+def add_vary(headers: MutableHeaders):
+    """Vary on Accept-Encoding, once even when an inner app already set it"""
+    if "accept-encoding" not in headers.get("vary", "").lower():
+        headers.add_vary_header("Accept-Encoding")
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Preferred encoding the client accepts: ``br``, ``gzip`` or None"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.partition(";")
+        name, _, value = params.partition("=")
+        if name.strip() == "q":
+            try:
+                if float(value) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+class _Encoder:
+    """Streaming compressor for one response"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=level)
+            self._compress, self._finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+            self._compress, self._finish = compressor.compress, compressor.flush
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def _timed(self, func, *args) -> bytes:
+        started = time.perf_counter()
+        data = func(*args)
+        self.seconds += time.perf_counter() - started
+        self.bytes_out += len(data)
+        return data
+
+    def compress(self, data: bytes) -> bytes:
+        self.bytes_in += len(data)
+        return self._timed(self._compress, data)
+
+    def finish(self) -> bytes:
+        data = self._timed(self._finish)
+        record(self.encoding, self.bytes_in, self.bytes_out, self.seconds)
+        return data
+
+def record(encoding: str, bytes_in: int, bytes_out: int, seconds: float):
+    metrics.inc(f"compression_responses_{encoding}")
+    metrics.inc("compression_bytes_in", bytes_in)
+    metrics.inc("compression_bytes_out", bytes_out)
+    metrics.inc("compression_bytes_saved", bytes_in - bytes_out)
+    metrics.inc("compression_cpu_ms", seconds * 1000)
+
+def compress(encoding: str, body: bytes, level: int) -> bytes:
+    """Compress a whole body at once"""
+    encoder = _Encoder(encoding, level)
+    return encoder.compress(body) + encoder.finish()
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: Optional[int] = None,
+                 gzip_level: Optional[int] = None, brotli_quality: Optional[int] = None):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else min_size()
+        self.levels = {
+            "gzip": gzip_level if gzip_level is not None else int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6')),
+            "br": brotli_quality if brotli_quality is not None else int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4')),
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+            if encoding:
+                responder = _CompressionResponder(self.app, self.minimum_size, encoding, self.levels[encoding])
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class _CompressionResponder:
+    """Same flow as Starlette's GZipResponder, for any encoder"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int, encoding: str, level: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoding = encoding
+        self.level = level
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.encoder: Optional[_Encoder] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # Hold the start message until the first body chunk decides the headers
+            self.initial_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] == 206
+                or headers.get("content-type", "").startswith(INCOMPRESSIBLE_TYPES)
+            )
+        elif message_type != "http.response.body":
+            await self.send(message)
+        elif self.passthrough:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+        elif not self.started:
+            self.started = True
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+
+            self.encoder = _Encoder(self.encoding, self.level)
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            add_vary(headers)
+            if more_body:
+                del headers["Content-Length"]
+                message["body"] = self.encoder.compress(body)
+            else:
+                message["body"] = self.encoder.compress(body) + self.encoder.finish()
+                headers["Content-Length"] = str(len(message["body"]))
+            await self.send(self.initial_message)
+            await self.send(message)
+        else:
+            # Remaining chunks of a streamed response
+            body = self.encoder.compress(message.get("body", b""))
+            if not message.get("more_body", False):
+                body += self.encoder.finish()
+            message["body"] = body
+            await self.send(message)
+
+class PrecompressedBody:
+    """A response body compressed at most once per encoding and then reused"""
+
+    def __init__(self, body: bytes, media_type: str = "application/json"):
+        self.body = body
+        self.media_type = media_type
+        self._encoded = {}
+
+    async def response(self, request, headers: Optional[dict] = None) -> Response:
+        headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+        if encoding is None or len(self.body) < min_size():
+            return Response(self.body, media_type=self.media_type, headers=headers)
+
+        reused = encoding in self._encoded
+        try:
+            encoded = await self._encode(encoding)
+        except Exception:
+            # The failed build is already dropped: the next request tries again
+            metrics.inc("compression_errors")
+            return Response(self.body, media_type=self.media_type, headers=headers)
+        if reused:
+            # The build itself was recorded by compress()
+            metrics.inc("compression_precompressed_hits")
+            metrics.inc("compression_bytes_saved", len(self.body) - len(encoded))
+        return Response(encoded, media_type=self.media_type, headers={**headers, "Content-Encoding": encoding})
+
+    def _encode(self, encoding: str) -> asyncio.Future:
+        task = self._encoded.get(encoding)
+        if task is None:
+            # Concurrent first requests share one compression, run off the event loop
+            task = self._encoded[encoding] = asyncio.ensure_future(
+                run_in_threadpool(compress, encoding, self.body, static_level(encoding))
+            )
+            task.add_done_callback(lambda done: self._forget_failed(encoding, done))
+        return task
+
+    def _forget_failed(self, encoding: str, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is None:
+            return
+        if self._encoded.get(encoding) is task:
+            del self._encoded[encoding]
+
+    async def prepare(self):
+        """Compress for every supported encoding ahead of the first request (warm-up)"""
+        if len(self.body) >= min_size():
+            await asyncio.gather(*[self._encode(encoding) for encoding in (["br"] if brotli else []) + ["gzip"]])
@@ -0,0 +1,59 @@
+"""Admin configuration (notification recipients) held in memory.
+
+The single ``admin_config`` document is loaded once at startup and served from
+memory. ``update`` writes it with an incremented ``version`` and refreshes this
+worker immediately; other workers poll just the version (one small document,
+one projected field) every ``CONFIG_POLL_SECONDS`` and reload when it
+changed. Request routes therefore never read the database for recipients.
+"""
+import os
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+DEFAULTS = {"email": "", "phone": ""}
+
+def poll_seconds() -> int:
+    return int(os.environ.get('CONFIG_POLL_SECONDS', '30'))
+
+class ConfigService:
+    def __init__(self, collection):
+        self.collection = collection
+        self._config = dict(DEFAULTS)
+        self._version: Optional[int] = None
+
+    async def load(self) -> dict:
+        doc = await self.collection.find_one({}, {"_id": 0})
+        self._apply(doc)
+        return self.get()
+
+    def _apply(self, doc: Optional[dict]):
+        doc = doc or {}
+        self._version = doc.get("version", 0)
+        self._config = {**DEFAULTS, **{k: v for k, v in doc.items() if k != "version"}}
+
+    def get(self) -> dict:
+        return dict(self._config)
+
+    async def update(self, values: dict) -> dict:
+        doc = await self.collection.find_one_and_update(
+            {},
+            {"$set": values, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._apply(doc)
+        return self.get()
+
+    async def refresh(self) -> bool:
+        """Reload when another worker changed the config; returns whether it did"""
+        doc = await self.collection.find_one({}, {"_id": 0, "version": 1})
+        if (doc or {}).get("version", 0) == self._version:
+            return False
+        await self.load()
+        return True
+
+    def email_recipient(self) -> str:
+        """Where request notifications go: the configured email, else EMAIL_DESTINATARY"""
+        return self._config.get("email") or os.environ.get('EMAIL_DESTINATARY', '')
@@ -0,0 +1,46 @@
+"""Google Cloud Storage bucket for uploads (``UPLOAD_STORAGE=gcs``, the default).
+
+Credentials come from the service account fields in the environment.
+"""
+import os
+
+from google.cloud import storage
+from google.oauth2 import service_account
+
+class GcsConfigError(Exception):
+    pass
+
+def upload_storage() -> str:
+    """Where uploads live: "gcs" (default) or "local" (served from /uploads)"""
+    return os.environ.get('UPLOAD_STORAGE', 'gcs')
+
+def bucket() -> storage.Bucket:
+    bucket_name = os.environ.get('GCS_BUCKET_NAME')
+    project_id = os.environ.get('GOOGLE_PROJECT_ID')
+    private_key = os.environ.get('GOOGLE_PRIVATE_KEY')
+    client_email = os.environ.get('GOOGLE_CLIENT_EMAIL')
+
+    if not bucket_name or not project_id or not private_key or not client_email:
+        raise GcsConfigError("Configuración de Google Cloud incompleta en variables de entorno")
+
+    service_account_info = {
+        "type": "service_account",
+        "project_id": project_id,
+        "private_key_id": os.environ.get('GOOGLE_PRIVATE_KEY_ID'),
+        "private_key": private_key.replace('\\n', '\n'),
+        "client_email": client_email,
+        "client_id": os.environ.get('GOOGLE_CLIENT_ID'),
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+        "client_x509_cert_url": os.environ.get('GOOGLE_CLIENT_X509_CERT_URL')
+    }
+    credentials = service_account.Credentials.from_service_account_info(service_account_info)
+    return storage.Client(credentials=credentials, project=project_id).bucket(bucket_name)
+
+def make_public(blob):
+    # Buckets with uniform access control reject per-object ACLs; they are public as a whole
+    try:
+        blob.make_public()
+    except Exception:
+        pass
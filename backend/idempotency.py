@@ -0,0 +1,117 @@
+"""``Idempotency-Key`` support for request-creation routes.
+
+The first call with a key claims it in a TTL-indexed collection, runs the route
+and stores the response. Replays (same key, same body) return the stored
+response without touching the write path; a per-worker TTL cache answers most
+replays without a database read. A claim is only held for
+``IDEMPOTENCY_LEASE_SECONDS``: if the worker dies before storing the response,
+a retry after that takes the key over instead of getting 409 until the TTL.
+"""
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Optional
+
+from cachetools import TTLCache
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+def ttl_seconds() -> int:
+    return int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 60 * 60)))
+
+def lease_seconds() -> int:
+    return int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '60'))
+
+class IdempotencyStore:
+    """Stored responses keyed by route scope and client key"""
+
+    def __init__(self, collection, cache_size: int = 10000, cache_ttl: int = 600):
+        self.collection = collection
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("created_at", 1)], expireAfterSeconds=ttl_seconds())
+
+    def _replay(self, record: dict, fingerprint: str) -> JSONResponse:
+        if record["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="La clave de idempotencia ya se usó con otros datos")
+        return JSONResponse(content=record["response"], headers={"Idempotent-Replayed": "true"})
+
+    async def run(self, request: Request, scope: str, payload: dict, handler: Callable[[], Awaitable]):
+        """Run ``handler`` once per Idempotency-Key; without the header it just runs"""
+        key = request.headers.get(HEADER)
+        if not key:
+            return await handler()
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Clave de idempotencia inválida")
+
+        record_id = f"{scope}:{key}"
+        fingerprint = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+        cached = self.cache.get(record_id)
+        if cached:
+            return self._replay(cached, fingerprint)
+
+        stored = await self.collection.find_one({"_id": record_id, "status": "done"})
+        if stored:
+            self.cache[record_id] = stored
+            return self._replay(stored, fingerprint)
+
+        claim_id = await self._claim(record_id, fingerprint)
+        if claim_id is None:
+            stored = await self.collection.find_one({"_id": record_id, "status": "done"})
+            if stored:
+                # Finished between the read above and the claim
+                self.cache[record_id] = stored
+                return self._replay(stored, fingerprint)
+            raise HTTPException(status_code=409, detail="La solicitud ya se está procesando")
+
+        # Only touch the record while it is still our claim (a retry may have taken over an expired one)
+        claimed = {"_id": record_id, "claim_id": claim_id}
+        try:
+            result = await handler()
+        except Exception:
+            # Failed attempts can be retried with the same key
+            await self.collection.delete_one(claimed)
+            raise
+
+        response = jsonable_encoder(result)
+        record = {"status": "done", "fingerprint": fingerprint, "response": response}
+        await self.collection.update_one(claimed, {"$set": record, "$unset": {"claimed_until": ""}})
+        self.cache[record_id] = record
+        return result
+
+    async def _claim(self, record_id: str, fingerprint: str) -> Optional[str]:
+        """Claim the key for this attempt; returns the claim id, or None if another attempt holds it"""
+        now = datetime.now(timezone.utc)
+        claim = {
+            "status": "in_progress",
+            "fingerprint": fingerprint,
+            "claim_id": uuid.uuid4().hex,
+            "claimed_until": now + timedelta(seconds=lease_seconds()),
+            "created_at": now,
+        }
+        # A concurrent retry with the same key loses the insert
+        try:
+            await self.collection.insert_one({"_id": record_id, **claim})
+            return claim["claim_id"]
+        except DuplicateKeyError:
+            pass
+        # The holder may have died mid-request: take over once its lease has run out
+        expired = await self.collection.find_one_and_update(
+            {
+                "_id": record_id,
+                "status": "in_progress",
+                "$or": [{"claimed_until": {"$lte": now}}, {"claimed_until": {"$exists": False}}],
+            },
+            {"$set": claim},
+            projection={"_id": 1}
+        )
+        return claim["claim_id"] if expired else None
@@ -1,41 +1,87 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, Request, BackgroundTasks, UploadFile, File, Form, Body
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import random
+import time
 import httpx
-from google.cloud import storage
-from google.oauth2 import service_account
 from email_service import send_email
-from pymongo.server_api import ServerApi
+from repository import Repository, create_client, min_pool_size, PRODUCT_STOCK_PROJECTION, VISIBLE_PRODUCTS
+from catalog_cache import CatalogCache
+from cachetools import TTLCache
+import verification_store
+from rate_limit import RateLimiter
+import analytics
+import archiver
+import ranking
+import stock
+import catalog_versions
+import profiling
+import compression
+import static_files
+from transcoder import Transcoder
+from back_in_stock import BackInStockNotifier
+from static_files import UploadFiles
+import reaper
+import metrics
+from idempotency import IdempotencyStore
+from scheduler import Scheduler
+import config_service
+import gcs
+import suggest
+import popularity
+import related
+from logging_setup import configure_logging, shutdown_logging, log_event
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-# Tls will be true, if the environment is production
-client = AsyncIOMotorClient(mongo_url, tls=os.environ.get('ENVIRONMENT') == 'production', server_api=ServerApi('1'))
+client = create_client(mongo_url, event_listeners=[profiling.command_timer])
 db = client[os.environ['DB_NAME']]
+repo = Repository(db)
+idempotency_store = IdempotencyStore(repo.idempotency_keys)
+catalog_cache = CatalogCache(ttl=int(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '60')))
+rate_limiter = RateLimiter(repo.rate_limits)
+code_store = verification_store.create_code_store(repo.pending_verifications)
+back_in_stock = BackInStockNotifier(repo)
+# Phones known to be verified; verification is never revoked, so hits are always valid
+verified_phones_cache = TTLCache(maxsize=100000, ttl=24 * 60 * 60)
+scheduler = Scheduler()
+admin_config = config_service.ConfigService(repo.admin_config)
+suggest_index = suggest.SuggestIndex()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up before the first request and drain before exiting (see startup/shutdown at the bottom)"""
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.state.status = "starting"  # starting -> ready -> draining, reported by /readyz
 
 # Ensure uploads directory exists
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 # Mount static files
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", UploadFiles(directory=UPLOAD_DIR), name="uploads")
+transcoder = Transcoder(repo, UPLOAD_DIR)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -68,6 +114,11 @@ class ProductImage(BaseModel):
     description: Optional[str] = None
     type: str = "image"  # "image" or "video"
     transform: Optional[ImageTransform] = ImageTransform()
+    # Video renditions, filled in by the transcoder (see transcoder.py)
+    mp4_url: Optional[str] = None
+    hls_url: Optional[str] = None
+    poster_url: Optional[str] = None
+    transcode_status: Optional[str] = None  # pending, processing, ready, failed
 
 class Product(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -82,7 +133,9 @@ class Product(BaseModel):
     images: Optional[List[ProductImage]] = []  # Nueva galería de imágenes
     category: Optional[str] = None
     is_visible: bool = False
-    display_order: int = 0
+    display_order: int = 0  # Legacy order, only used for products without a rank (see ranking.rebalance)
+    rank: Optional[str] = None  # Fractional sort key, see ranking.py
+    version: Optional[int] = None  # Catalog change version of the last write, see catalog_versions.py
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ProductCreate(BaseModel):
@@ -95,7 +148,10 @@ class ProductCreate(BaseModel):
     images: Optional[List[ProductImage]] = []
     category: Optional[str] = None
     is_visible: bool = False
-    display_order: int = 0
+    display_order: Optional[int] = Field(None, deprecated="Ignored: the order is set with /products/{id}/move or /products/reorder")
+
+class ProductBatchRequest(BaseModel):
+    ids: List[str]
 
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
@@ -107,7 +163,32 @@ class ProductUpdate(BaseModel):
     images: Optional[List[ProductImage]] = None
     category: Optional[str] = None
     is_visible: Optional[bool] = None
-    display_order: Optional[int] = None
+    display_order: Optional[int] = Field(None, deprecated="Ignored: the order is set with /products/{id}/move or /products/reorder")
+
+class PurchaseLine(BaseModel):
+    product_id: str
+    product_name: str
+    category: Optional[str] = None
+    quantity: int
+    unit_price: float
+    total_price: float
+
+class CartItem(BaseModel):
+    product_id: str
+    quantity: int = Field(gt=0)
+
+class PurchaseData(BaseModel):
+    user_email: str
+    user_name: str
+    user_phone: str
+    product_id: str
+    quantity: int = Field(gt=0)
+
+class CartPurchaseData(BaseModel):
+    user_email: str
+    user_name: str
+    user_phone: str
+    items: List[CartItem] = []
 
 class PurchaseRequest(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -116,11 +197,13 @@ class PurchaseRequest(BaseModel):
     user_email: str
     user_name: str
     user_phone: str
-    product_id: str
+    product_id: Optional[str] = None  # None for cart requests, see items
     product_name: str
     quantity: int
     total_price: float
-    status: str = "pending"  # pending, completed, cancelled
+    category: Optional[str] = None
+    items: Optional[List[PurchaseLine]] = None  # Cart requests: one line per product
+    status: str = "pending"  # pending, completed, rejected, expired
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class OutOfStockRequest(BaseModel):
@@ -133,6 +216,7 @@ class OutOfStockRequest(BaseModel):
     quantity: int
     code: Optional[str] = None
     verified: bool = False
+    status: str = "pending"  # pending, completed
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class CustomRequest(BaseModel):
@@ -144,6 +228,7 @@ class CustomRequest(BaseModel):
     quantity: int
     code: Optional[str] = None
     verified: bool = False
+    status: str = "pending"  # pending, completed
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class VerifiedPhone(BaseModel):
@@ -176,15 +261,15 @@ async def get_current_user(request: Request) -> Optional[User]:
     if not session_token:
         return None
     
-    session = await db.get_collection("user_sessions").find_one({"session_token": session_token})
+    session = await repo.get_session(session_token)
     if not session:
         return None
     
     if datetime.fromisoformat(session["expires_at"]) < datetime.now(timezone.utc):
-        await db.get_collection("user_sessions").delete_one({"session_token": session_token})
+        await repo.sessions.delete_one({"session_token": session_token})
         return None
     
-    user_doc = await db.get_collection("users").find_one({"id": session["user_id"]}, {"_id": 0})
+    user_doc = await repo.get_user({"id": session["user_id"]})
     if not user_doc:
         return None
     
@@ -213,13 +298,13 @@ async def set_admin_user(user_id: str, request: Request) -> Optional[User]:
     """Set admin user from id"""
     await require_admin(request)
     
-    existing = await db.get_collection("users").find_one({"id": user_id})
+    existing = await repo.get_user({"id": user_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
-    await db.get_collection("users").update_one({"id": user_id}, {"$set": { "role": "admin" }})
+    await repo.users.update_one({"id": user_id}, {"$set": { "role": "admin" }})
     
-    updated_user = await db.get_collection("users").find_one({"id": user_id}, {"_id": 0})
+    updated_user = await repo.get_user({"id": user_id})
     if isinstance(updated_user.get('created_at'), str):
         updated_user['created_at'] = datetime.fromisoformat(updated_user['created_at'])
     
@@ -248,7 +333,7 @@ async def create_session(request: Request, response: Response):
             raise HTTPException(status_code=401, detail=f"Error al validar sesión: {str(e)}")
     
     # Check if user exists
-    existing_user = await db.get_collection("users").find_one({"email": data["email"]}, {"_id": 0})
+    existing_user = await repo.get_user({"email": data["email"]})
     
     if not existing_user:
         # Create new user
@@ -261,7 +346,7 @@ async def create_session(request: Request, response: Response):
         )
         user_doc = user.model_dump()
         user_doc['created_at'] = user_doc['created_at'].isoformat()
-        await db.get_collection("users").insert_one(user_doc)
+        await repo.users.insert_one(user_doc)
     else:
         if isinstance(existing_user.get('created_at'), str):
             existing_user['created_at'] = datetime.fromisoformat(existing_user['created_at'])
@@ -281,7 +366,7 @@ async def create_session(request: Request, response: Response):
     session_doc['expires_at'] = session_doc['expires_at'].isoformat()
     session_doc['created_at'] = session_doc['created_at'].isoformat()
     
-    await db.get_collection("user_sessions").insert_one(session_doc)
+    await repo.sessions.insert_one(session_doc)
     
     # Set cookie
     response.set_cookie(
@@ -312,7 +397,7 @@ async def logout(request: Request, response: Response):
     """Logout user"""
     session_token = request.cookies.get("session_token")
     if session_token:
-        await db.get_collection("user_sessions").delete_one({"session_token": session_token})
+        await repo.sessions.delete_one({"session_token": session_token})
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Sesión cerrada"}
@@ -327,52 +412,26 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
         product_name = data.get("product_name")
         if not product_name:
             raise HTTPException(status_code=400, detail="Nombre del producto es requerido")
-        destination = f"{product_name}/{file.filename}"
-
-        # Generate unique filename
-        file_ext = os.path.splitext(file.filename)[1]
-        filename = f"{uuid.uuid4()}{file_ext}"
-        
-        # GCS Configuration
-        bucket_name = os.environ.get('GCS_BUCKET_NAME')
-        project_id = os.environ.get('GOOGLE_PROJECT_ID')
-        private_key_id = os.environ.get('GOOGLE_PRIVATE_KEY_ID')
-        private_key = os.environ.get('GOOGLE_PRIVATE_KEY')
-        client_email = os.environ.get('GOOGLE_CLIENT_EMAIL')
-        client_id = os.environ.get('GOOGLE_CLIENT_ID')
-        client_x509_cert_url = os.environ.get('GOOGLE_CLIENT_X509_CERT_URL')
-
-        if not bucket_name or not project_id or not private_key or not client_email:
-             raise HTTPException(status_code=500, detail="Configuración de Google Cloud incompleta en variables de entorno")
-
-        # Construct credentials
-        service_account_info = {
-            "type": "service_account",
-            "project_id": project_id,
-            "private_key_id": private_key_id,
-            "private_key": private_key.replace('\\n', '\n'),
-            "client_email": client_email,
-            "client_id": client_id,
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": client_x509_cert_url
-        }
-
-        # Initialize GCS client
-        credentials = service_account.Credentials.from_service_account_info(service_account_info)
-        storage_client = storage.Client(credentials=credentials, project=project_id)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination)
         
-        # Read and upload content
+        # Content-addressed name: a URL always means the same bytes, so it can be cached forever
         content = await file.read()
-        blob.upload_from_string(content, content_type=file.content_type)
+        filename = static_files.content_addressed_name(content, file.filename)
+        
+        if gcs.upload_storage() == 'local':
+            # Writes the file and its compressed sidecars: keep it off the event loop
+            await run_in_threadpool(static_files.save_upload, UPLOAD_DIR, content, file.filename, file.content_type)
+            return {"url": f"{str(request.base_url).rstrip('/')}/uploads/{filename}", "type": file.content_type}
         
         try:
-            blob.make_public()
-        except Exception:
-            pass
+            bucket = gcs.bucket()
+        except gcs.GcsConfigError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        blob = bucket.blob(f"{product_name}/{filename}")
+        blob.cache_control = static_files.IMMUTABLE
+        
+        # Upload content
+        blob.upload_from_string(content, content_type=file.content_type)
+        gcs.make_public(blob)
             
         return {"url": blob.public_url, "type": file.content_type}
         
@@ -383,8 +442,11 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
 # ==================== PRODUCT ROUTES ====================
 
 @api_router.get("/products", response_model=List[Product])
-async def get_products(request: Request, include_hidden: bool = False):
-    """Get all products"""
+async def get_products(request: Request, include_hidden: bool = False, category: Optional[str] = None,
+                       sort: Optional[str] = None):
+    """Get all products, optionally from a single category; sort=popular puts best sellers first"""
+    if sort not in (None, "popular"):
+        raise HTTPException(status_code=400, detail="Orden no válido")
     query = {}
     
     is_admin = False
@@ -394,22 +456,75 @@ async def get_products(request: Request, include_hidden: bool = False):
             is_admin = True
             
     if not is_admin:
-        query = {"$or": [{"is_visible": True}, {"is_visible": {"$exists": False}}]}
+        query = dict(VISIBLE_PRODUCTS)
+    if category:
+        # Served by the (category, rank) index
+        query["category"] = category
         
-    products = await db.get_collection("products").find(query, {"_id": 0}).sort("display_order", 1).to_list(1000)
-    
+    if is_admin:
+        return _normalize_products(await list_sorted_products(query, sort))
+    
+    return await (await public_catalog(query, category, sort)).response(request)
+
+async def public_catalog(query: dict, category: Optional[str], sort: Optional[str] = None) -> compression.PrecompressedBody:
+    """The visible catalog, serialized (and compressed on demand) once per catalog version"""
+    version = await catalog_versions.current_version(repo)
+    # Popularity changes without a new catalog version: that order is as fresh as the cache TTL
+    key = f"products:{category or ''}:{sort or ''}"
+    cached = catalog_cache.get(key)
+    if cached is None or cached[0] != version:
+        # From the primary: a lagging secondary could return the list from before ``version``
+        products = _normalize_products(await list_sorted_products(query, sort, primary=True))
+        cached = (version, compression.PrecompressedBody(PRODUCT_LIST.dump_json(PRODUCT_LIST.validate_python(products))))
+        catalog_cache.set(key, cached)
+    return cached[1]
+
+PRODUCT_LIST = TypeAdapter(List[Product])
+
+async def list_sorted_products(query: dict, sort: Optional[str], primary: bool = False) -> List[dict]:
+    if sort == "popular":
+        products, ranked = await asyncio.gather(repo.list_products(query, primary=primary), popularity.ranked_ids(repo))
+        return popularity.sort_popular(products, ranked)
+    return await repo.list_products(query, primary=primary)
+
+def _normalize_products(products: List[dict]) -> List[dict]:
     for product in products:
         if isinstance(product.get('created_at'), str):
             product['created_at'] = datetime.fromisoformat(product['created_at'])
         if 'is_visible' not in product:
             product['is_visible'] = True
-    
     return products
 
+@api_router.get("/products/changes")
+async def get_product_changes(request: Request, since: int = 0, include_hidden: bool = False, limit: int = 500):
+    """Products changed and deleted after catalog version ``since`` (since=0: full catalog)"""
+    is_admin = False
+    if include_hidden:
+        user = await get_current_user(request)
+        is_admin = bool(user and user.role == "admin")
+    
+    return await catalog_versions.changes_since(repo, max(since, 0), is_admin, limit=min(max(limit, 1), 1000))
+
+@api_router.get("/products/categories")
+async def get_categories():
+    """Categories with visible product counts and price ranges"""
+    facets = catalog_cache.get("categories")
+    if facets is None:
+        facets = await repo.category_facets()
+        catalog_cache.set("categories", facets)
+    return facets
+
+MAX_SUGGESTIONS = 20
+
+@api_router.get("/products/suggest")
+async def suggest_products(prefix: str = "", limit: int = 8):
+    """Typeahead: visible products and categories whose words start with ``prefix`` (from memory)"""
+    return suggest_index.suggest(prefix, min(max(limit, 1), MAX_SUGGESTIONS))
+
 @api_router.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str, request: Request):
     """Get product by ID"""
-    product = await db.get_collection("products").find_one({"id": product_id}, {"_id": 0})
+    product = await repo.get_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
@@ -425,26 +540,61 @@ async def get_product(product_id: str, request: Request):
     
     return Product(**product)
 
+@api_router.get("/products/{product_id}/related", response_model=List[Product])
+async def get_related_products(product_id: str):
+    """Products customers also asked for, from the precomputed co-occurrence job"""
+    return _normalize_products(await repo.related_products_of(product_id))
+
+MAX_BATCH_PRODUCTS = 100
+
+@api_router.post("/products/batch")
+async def get_products_batch(data: ProductBatchRequest, request: Request):
+    """Get several products by ID, in the requested order"""
+    product_ids = list(dict.fromkeys(data.ids))
+    if len(product_ids) > MAX_BATCH_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_BATCH_PRODUCTS} productos por solicitud")
+    
+    found = {product["id"]: product for product in await repo.get_products_by_ids(product_ids)}
+    
+    # Same visibility rule as get_product, with a single auth check for the whole batch
+    if any(not product.get("is_visible", True) for product in found.values()):
+        user = await get_current_user(request)
+        if not user or user.role != "admin":
+            found = {product_id: product for product_id, product in found.items() if product.get("is_visible", True)}
+    
+    products = []
+    missing = []
+    for product_id in product_ids:
+        product = found.get(product_id)
+        if not product:
+            missing.append(product_id)
+            continue
+        if isinstance(product.get('created_at'), str):
+            product['created_at'] = datetime.fromisoformat(product['created_at'])
+        products.append(Product(**product))
+    
+    return {"products": products, "missing": missing}
+
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate, request: Request):
     """Create product (admin only)"""
     await require_admin(request)
     
-    # Calculate display order
-    if product_data.display_order == 0:
-        # Find max display_order
-        max_order_product = await db.get_collection("products").find_one(sort=[("display_order", -1)])
-        if max_order_product and "display_order" in max_order_product:
-            product_data.display_order = max_order_product["display_order"] + 1
-        else:
-            product_data.display_order = 0
-
-    product = Product(**product_data.model_dump())
+    # New products go last
+    product = Product(
+        **product_data.model_dump(exclude={"display_order"}), rank=ranking.rank_between(await repo.max_rank(), None)
+    )
     product_doc = product.model_dump()
     product_doc['created_at'] = product_doc['created_at'].isoformat()
+    product_doc.update(await catalog_versions.next_stamp(repo))
+    videos = transcoder.pending_videos(product_doc.get('images'))
     
-    await db.get_collection("products").insert_one(product_doc)
-    return product
+    await repo.products.insert_one(product_doc)
+    catalog_cache.invalidate()
+    suggest_index.upsert(product_doc)
+    for url in videos:
+        transcoder.enqueue(url)
+    return Product(**product_doc)
 
 class ProductReorderItem(BaseModel):
     id: str
@@ -453,39 +603,88 @@ class ProductReorderItem(BaseModel):
 class ProductReorderRequest(BaseModel):
     items: List[ProductReorderItem]
 
+class ProductMoveRequest(BaseModel):
+    before_id: Optional[str] = None  # Place the product right before this one
+    after_id: Optional[str] = None  # ...or right after this one (neither: move to the end)
+
 @api_router.put("/products/reorder")
 async def reorder_products(data: ProductReorderRequest, request: Request):
-    """Reorder products (admin only)"""
+    """Reorder products from the full list (admin only)"""
     await require_admin(request)
     
-    from pymongo import UpdateOne
-    
-    operations = []
-    for item in data.items:
-        operations.append(
-            UpdateOne({"id": item.id}, {"$set": {"display_order": item.display_order}})
-        )
+    ids = [item.id for item in sorted(data.items, key=lambda item: item.display_order)]
+    current = await repo.find(repo.products, {"id": {"$in": ids}}, {"_id": 0, "id": 1, "rank": 1}, limit=len(ids))
+    ranks = {product["id"]: product.get("rank") for product in current}
     
-    if operations:
-        await db.get_collection("products").bulk_write(operations)
+    # Only products whose rank is out of order get rewritten (one write for a single drag)
+    await ranking.apply_ranks(repo, ranking.reorder_ranks(ids, [ranks.get(product_id) for product_id in ids]))
         
     return {"message": "Orden actualizado"}
 
+@api_router.put("/products/{product_id}/move")
+async def move_product(product_id: str, data: ProductMoveRequest, request: Request):
+    """Move one product before/after another with a single write (admin only)"""
+    await require_admin(request)
+    
+    anchor_id = data.before_id or data.after_id
+    if anchor_id == product_id:
+        raise HTTPException(status_code=400, detail="Un producto no puede moverse junto a sí mismo")
+    
+    if anchor_id:
+        anchor = await repo.get_product(anchor_id, {"_id": 0, "rank": 1}, primary=True)
+        if not anchor or not anchor.get("rank"):
+            raise HTTPException(status_code=404, detail="Producto no encontrado")
+        neighbor = await repo.neighbor_rank(anchor["rank"], product_id, before=bool(data.before_id))
+        if data.before_id:
+            rank = ranking.rank_between(neighbor, anchor["rank"])
+        else:
+            rank = ranking.rank_between(anchor["rank"], neighbor)
+    else:
+        rank = ranking.rank_between(await repo.max_rank(), None)
+    
+    result = await repo.products.update_one(
+        {"id": product_id},
+        catalog_versions.stamped({"$set": {"rank": rank}}, await catalog_versions.next_stamp(repo))
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    
+    return {"message": "Orden actualizado", "rank": rank}
+
 
 @api_router.put("/products/{product_id}", response_model=Product)
 async def update_product(product_id: str, product_data: ProductUpdate, request: Request):
     """Update product (admin only)"""
     await require_admin(request)
     
-    existing = await db.get_collection("products").find_one({"id": product_id})
+    existing = await repo.get_product(product_id, {"_id": 0, "id": 1}, primary=True)
     if not existing:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    update_data = {k: v for k, v in product_data.model_dump().items() if v is not None}
+    update_data = {k: v for k, v in product_data.model_dump(exclude={"display_order"}).items() if v is not None}
+    videos = transcoder.pending_videos(update_data.get('images'))
     if update_data:
-        await db.get_collection("products").update_one({"id": product_id}, {"$set": update_data})
-    
-    updated_product = await db.get_collection("products").find_one({"id": product_id}, {"_id": 0})
+        previous = await repo.products.find_one_and_update(
+            {"id": product_id},
+            catalog_versions.stamped({"$set": update_data}, await catalog_versions.next_stamp(repo)),
+            projection={"_id": 0, "stock": 1, "is_visible": 1}
+        )
+        if previous and "is_visible" in update_data:
+            was_visible = previous.get("is_visible", True)
+            if was_visible and not update_data["is_visible"]:
+                # Public clients that have it must drop it
+                await catalog_versions.add_tombstone(repo, product_id, await catalog_versions.next_stamp(repo), hidden=True)
+            elif not was_visible and update_data["is_visible"]:
+                await catalog_versions.remove_hidden_tombstone(repo, product_id)
+        catalog_cache.invalidate()
+        # Restocked: let the people waiting for it know
+        if previous and update_data.get("stock", 0) > previous.get("stock", 0):
+            back_in_stock.enqueue(product_id)
+    for url in videos:
+        transcoder.enqueue(url)
+    
+    updated_product = await repo.get_product(product_id, primary=True)
+    suggest_index.upsert(updated_product)
     if isinstance(updated_product.get('created_at'), str):
         updated_product['created_at'] = datetime.fromisoformat(updated_product['created_at'])
     
@@ -496,52 +695,70 @@ async def delete_product(product_id: str, request: Request):
     """Delete product (admin only)"""
     await require_admin(request)
     
-    result = await db.get_collection("products").delete_one({"id": product_id})
+    result = await repo.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
+    await catalog_versions.add_tombstone(repo, product_id, await catalog_versions.next_stamp(repo))
+    catalog_cache.invalidate()
+    suggest_index.remove(product_id)
     
     return {"message": "Producto eliminado"}
 
 # ==================== REQUEST ROUTES ====================
 
-@api_router.post("/requests/purchase")
-async def create_purchase_request(data: dict, background_tasks: BackgroundTasks):
-    """Create purchase request"""
+@api_router.post("/requests/purchase", dependencies=[Depends(rate_limiter)])
+async def create_purchase_request(data: PurchaseData, request: Request, background_tasks: BackgroundTasks):
+    """Create purchase request (supports Idempotency-Key)"""
+    return await idempotency_store.run(
+        request, "purchase", data.model_dump(), lambda: _create_purchase_request(data, background_tasks)
+    )
+
+async def _store_reserved_purchase(purchase_doc: dict):
+    """Store a request whose stock is already reserved; on any failure the stock is given back"""
+    inserted = False
+    try:
+        await repo.purchase_requests.insert_one(purchase_doc)
+        inserted = True
+        await analytics.record_created(repo, purchase_doc)
+        await popularity.record_requested(repo, purchase_doc)
+    except Exception:
+        if inserted:
+            await repo.purchase_requests.delete_one({"id": purchase_doc["id"]})
+        await stock.release(repo, [purchase_doc])
+        raise
+
+async def _create_purchase_request(data: PurchaseData, background_tasks: BackgroundTasks):
+    started = time.perf_counter()
     # Get product
-    product = await db.get_collection("products").find_one({"id": data["product_id"]}, {"_id": 0})
+    product = await repo.get_product(data.product_id, PRODUCT_STOCK_PROJECTION, primary=True)
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    if product["stock"] < data["quantity"]:
-        raise HTTPException(status_code=400, detail="Stock insuficiente")
-    
-    # Create request
+    # Build the request before taking stock: nothing below can fail on the input
     purchase = PurchaseRequest(
-        user_email=data["user_email"],
-        user_name=data["user_name"],
-        user_phone=data["user_phone"],
-        product_id=data["product_id"],
+        user_email=data.user_email,
+        user_name=data.user_name,
+        user_phone=data.user_phone,
+        product_id=data.product_id,
         product_name=product["name"],
-        quantity=data["quantity"],
-        total_price=product["price"] * data["quantity"]
+        category=product.get("category"),
+        quantity=data.quantity,
+        total_price=product["price"] * data.quantity
     )
     
     purchase_doc = purchase.model_dump()
     purchase_doc['created_at'] = purchase_doc['created_at'].isoformat()
     
-    await db.get_collection("purchase_requests").insert_one(purchase_doc)
-    
-    # Update stock
-    await db.get_collection("products").update_one(
-        {"id": data["product_id"]},
-        {"$inc": {"stock": -data["quantity"]}}
-    )
+    # Only decrements while enough stock is left, so concurrent requests cannot oversell
+    if await stock.reserve(repo, [purchase_doc]):
+        raise HTTPException(status_code=400, detail="Stock insuficiente")
+    await _store_reserved_purchase(purchase_doc)
     
     # Send email
-    user = (data["user_name"] or "Anónimo") + " " + (data["user_email"] or "Anónimo")
+    user = (data.user_name or "Anónimo") + " " + (data.user_email or "Anónimo")
     background_tasks.add_task(
         send_email,
-        destinatary=os.environ['EMAIL_DESTINATARY'],
+        destinatary=admin_config.email_recipient(),
         subject=f"Solicitud de compra #{purchase.id}",
         message=f"""
         <h1>Nueva solicitud de compra</h1>
@@ -554,39 +771,140 @@ async def create_purchase_request(data: dict, background_tasks: BackgroundTasks)
     )
     
     # Mock notification
-    logger.info(f"📧 MOCK EMAIL: Solicitud de compra #{purchase.id}")
-    logger.info(f"   Cliente: {user}")
-    logger.info(f"   Producto: {purchase.product_name}")
-    logger.info(f"   Cantidad: {purchase.quantity}")
-    logger.info(f"   Total: Lps {purchase.total_price:.2f}")
-    logger.info(f"   Teléfono: {purchase.user_phone}")
+    log_event(
+        logger, "purchase_request_created",
+        request_id=purchase.id,
+        customer=user,
+        product_id=purchase.product_id,
+        product_name=purchase.product_name,
+        quantity=purchase.quantity,
+        total_price=round(purchase.total_price, 2),
+        phone=purchase.user_phone,
+        duration_ms=round((time.perf_counter() - started) * 1000, 2)
+    )
     
     return purchase
 
-@api_router.post("/requests/verify-phone")
+MAX_CART_LINES = 50
+
+@api_router.post("/requests/purchase/cart", dependencies=[Depends(rate_limiter)])
+async def create_cart_purchase_request(data: CartPurchaseData, request: Request, background_tasks: BackgroundTasks):
+    """Create one purchase request for several products (supports Idempotency-Key)"""
+    return await idempotency_store.run(
+        request, "purchase-cart", data.model_dump(), lambda: _create_cart_purchase_request(data, background_tasks)
+    )
+
+async def _create_cart_purchase_request(data: CartPurchaseData, background_tasks: BackgroundTasks):
+    started = time.perf_counter()
+    
+    # Merge repeated products into one line
+    quantities = {}
+    for item in data.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    if not quantities:
+        raise HTTPException(status_code=400, detail="El carrito está vacío")
+    if len(quantities) > MAX_CART_LINES:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_CART_LINES} productos por solicitud")
+    
+    # Get all products in one query
+    products = {
+        product["id"]: product
+        for product in await repo.find(repo.products, {"id": {"$in": list(quantities)}}, PRODUCT_STOCK_PROJECTION,
+                                       limit=len(quantities))
+    }
+    if len(products) < len(quantities):
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    
+    lines = [
+        PurchaseLine(
+            product_id=product_id,
+            product_name=products[product_id]["name"],
+            category=products[product_id].get("category"),
+            quantity=quantity,
+            unit_price=products[product_id]["price"],
+            total_price=products[product_id]["price"] * quantity
+        )
+        for product_id, quantity in quantities.items()
+    ]
+    
+    # Build the request before taking stock: nothing below can fail on the input
+    purchase = PurchaseRequest(
+        user_email=data.user_email,
+        user_name=data.user_name,
+        user_phone=data.user_phone,
+        product_name=", ".join(line.product_name for line in lines),
+        quantity=sum(line.quantity for line in lines),
+        total_price=sum(line.total_price for line in lines),
+        items=lines
+    )
+    purchase_doc = purchase.model_dump()
+    purchase_doc['created_at'] = purchase_doc['created_at'].isoformat()
+    
+    # Reserve stock for every line, or for none
+    failed = await stock.reserve(repo, [line.model_dump() for line in lines])
+    if failed:
+        names = ", ".join(products[product_id]["name"] for product_id in failed)
+        raise HTTPException(status_code=400, detail=f"Stock insuficiente: {names}")
+    
+    await _store_reserved_purchase(purchase_doc)
+    
+    # Send one email for the whole cart
+    user = (data.user_name or "Anónimo") + " " + (data.user_email or "Anónimo")
+    rows = "".join(
+        f"<tr><td>{line.product_name}</td><td>{line.quantity}</td><td>Lps {line.total_price:.2f}</td></tr>"
+        for line in lines
+    )
+    background_tasks.add_task(
+        send_email,
+        destinatary=admin_config.email_recipient(),
+        subject=f"Solicitud de compra #{purchase.id}",
+        message=f"""
+        <h1>Nueva solicitud de compra</h1>
+        <p>Cliente: {user}</p>
+        <table>
+            <tr><th>Producto</th><th>Cantidad</th><th>Subtotal</th></tr>
+            {rows}
+        </table>
+        <p>Total: Lps {purchase.total_price:.2f}</p>
+        <p>Teléfono: {purchase.user_phone}</p>
+        """
+    )
+    
+    # Mock notification
+    log_event(
+        logger, "purchase_request_created",
+        request_id=purchase.id,
+        customer=user,
+        lines=len(lines),
+        quantity=purchase.quantity,
+        total_price=round(purchase.total_price, 2),
+        phone=purchase.user_phone,
+        duration_ms=round((time.perf_counter() - started) * 1000, 2)
+    )
+    
+    return purchase
+
+@api_router.post("/requests/verify-phone", dependencies=[Depends(rate_limiter)])
 async def verify_phone(data: dict):
     """Send verification code (Mock)"""
     phone = data["phone"]
     
     # Check if phone is already verified
-    verified = await db.get_collection("verified_phones").find_one({"phone": phone})
+    if phone in verified_phones_cache:
+        return {"already_verified": True, "message": "Teléfono ya verificado"}
+    verified = await repo.find_one(repo.verified_phones, {"phone": phone}, {"_id": 0, "phone": 1})
     if verified:
+        verified_phones_cache[phone] = True
         return {"already_verified": True, "message": "Teléfono ya verificado"}
     
     # Generate code
     code = str(random.randint(100000, 999999))
     
     # Store pending verification
-    await db.get_collection("pending_verifications").update_one(
-        {"phone": phone},
-        {"$set": {"code": code, "created_at": datetime.now(timezone.utc).isoformat()}},
-        upsert=True
-    )
+    await code_store.issue(phone, code)
     
-    # Mock WhatsApp notification
-    logger.info(f"📱 MOCK WHATSAPP: Código de verificación para {phone}")
-    logger.info(f"   Código: {code}")
-    logger.info(f"   ⚠️ Este código solo aparece en los logs del servidor")
+    # Mock WhatsApp: the code only appears in the server logs
+    log_event(logger, "verification_code_sent", channel="mock_whatsapp", phone=phone, code=code)
     
     return {"message": "Código enviado", "mock_code": code}
 
@@ -596,8 +914,12 @@ async def validate_code(data: dict):
     phone = data["phone"]
     code = data["code"]
     
-    pending = await db.get_collection("pending_verifications").find_one({"phone": phone})
-    if not pending or pending["code"] != code:
+    result = await code_store.check(phone, code)
+    if result == verification_store.EXPIRED:
+        raise HTTPException(status_code=400, detail="Código expirado")
+    if result == verification_store.LOCKED:
+        raise HTTPException(status_code=429, detail="Demasiados intentos, solicita un nuevo código")
+    if result != verification_store.OK:
         raise HTTPException(status_code=400, detail="Código inválido")
     
     # Mark as verified
@@ -606,24 +928,28 @@ async def validate_code(data: dict):
     verified_doc['verified_at'] = verified_doc['verified_at'].isoformat()
     verified_doc['last_used'] = verified_doc['last_used'].isoformat()
     
-    await db.get_collection("verified_phones").update_one(
+    await repo.verified_phones.update_one(
         {"phone": phone},
         {"$set": verified_doc},
         upsert=True
     )
-    
-    # Delete pending
-    await db.get_collection("pending_verifications").delete_one({"phone": phone})
+    verified_phones_cache[phone] = True
     
     return {"verified": True}
 
-@api_router.post("/requests/out-of-stock")
-async def create_out_of_stock_request(data: dict, background_tasks: BackgroundTasks):
-    """Request out of stock product"""
+@api_router.post("/requests/out-of-stock", dependencies=[Depends(rate_limiter)])
+async def create_out_of_stock_request(data: dict, request: Request, background_tasks: BackgroundTasks):
+    """Request out of stock product (supports Idempotency-Key)"""
+    return await idempotency_store.run(
+        request, "out-of-stock", data, lambda: _create_out_of_stock_request(data, background_tasks)
+    )
+
+async def _create_out_of_stock_request(data: dict, background_tasks: BackgroundTasks):
+    started = time.perf_counter()
     phone = data["phone"]
     
     # Get product
-    product = await db.get_collection("products").find_one({"id": data["product_id"]}, {"_id": 0})
+    product = await repo.get_product(data["product_id"], PRODUCT_STOCK_PROJECTION)
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
@@ -639,13 +965,14 @@ async def create_out_of_stock_request(data: dict, background_tasks: BackgroundTa
     request_doc = request_obj.model_dump()
     request_doc['created_at'] = request_doc['created_at'].isoformat()
     
-    await db.get_collection("out_of_stock_requests").insert_one(request_doc)
+    await repo.out_of_stock_requests.insert_one(request_doc)
+    await popularity.record_interest(repo, request_obj.product_id, request_obj.quantity)
 
     # Send email
     user = (data["user_name"] or "Anónimo") + " " + (data["user_email"] or "Anónimo")
     background_tasks.add_task(
         send_email,
-        destinatary=os.environ['EMAIL_DESTINATARY'],
+        destinatary=admin_config.email_recipient(),
         subject=f"Solicitud de artículo sin stock #{request_obj.id}",
         message=f"""
         <h1>Nueva solicitud de artículo sin stock</h1>
@@ -657,16 +984,28 @@ async def create_out_of_stock_request(data: dict, background_tasks: BackgroundTa
     )
     
     # Mock notification
-    logger.info(f"📧 MOCK EMAIL: Solicitud de artículo sin stock #{request_obj.id}")
-    logger.info(f"   Producto: {request_obj.product_name}")
-    logger.info(f"   Cantidad: {request_obj.quantity}")
-    logger.info(f"   Teléfono: {request_obj.phone}")
+    log_event(
+        logger, "out_of_stock_request_created",
+        request_id=request_obj.id,
+        customer=user,
+        product_id=request_obj.product_id,
+        product_name=request_obj.product_name,
+        quantity=request_obj.quantity,
+        phone=request_obj.phone,
+        duration_ms=round((time.perf_counter() - started) * 1000, 2)
+    )
     
     return request_obj
 
-@api_router.post("/requests/custom")
-async def create_custom_request(data: dict, background_tasks: BackgroundTasks):
-    """Request custom/non-existent product"""
+@api_router.post("/requests/custom", dependencies=[Depends(rate_limiter)])
+async def create_custom_request(data: dict, request: Request, background_tasks: BackgroundTasks):
+    """Request custom/non-existent product (supports Idempotency-Key)"""
+    return await idempotency_store.run(
+        request, "custom", data, lambda: _create_custom_request(data, background_tasks)
+    )
+
+async def _create_custom_request(data: dict, background_tasks: BackgroundTasks):
+    started = time.perf_counter()
     phone = data["phone"]
     
     # Create request
@@ -680,13 +1019,13 @@ async def create_custom_request(data: dict, background_tasks: BackgroundTasks):
     request_doc = request_obj.model_dump()
     request_doc['created_at'] = request_doc['created_at'].isoformat()
     
-    await db.get_collection("custom_requests").insert_one(request_doc)
+    await repo.custom_requests.insert_one(request_doc)
 
     # Send email
     user = (data["user_name"] or "Anónimo") + " " + (data["user_email"] or "Anónimo")
     background_tasks.add_task(
         send_email,
-        destinatary=os.environ['EMAIL_DESTINATARY'],
+        destinatary=admin_config.email_recipient(),
         subject=f"Solicitud de artículo personalizado #{request_obj.id}",
         message=f"""
         <h1>Nueva solicitud de artículo personalizado</h1>
@@ -698,10 +1037,15 @@ async def create_custom_request(data: dict, background_tasks: BackgroundTasks):
     )
     
     # Mock notification
-    logger.info(f"📧 MOCK EMAIL: Solicitud de artículo personalizado #{request_obj.id}")
-    logger.info(f"   Descripción: {request_obj.description}")
-    logger.info(f"   Cantidad: {request_obj.quantity}")
-    logger.info(f"   Teléfono: {request_obj.phone}")
+    log_event(
+        logger, "custom_request_created",
+        request_id=request_obj.id,
+        customer=user,
+        description=request_obj.description,
+        quantity=request_obj.quantity,
+        phone=request_obj.phone,
+        duration_ms=round((time.perf_counter() - started) * 1000, 2)
+    )
     
     return request_obj
 
@@ -710,9 +1054,9 @@ async def get_all_requests(request: Request):
     """Get all requests (admin only)"""
     await require_admin(request)
     
-    purchase_requests = await db.get_collection("purchase_requests").find({}, {"_id": 0}).to_list(1000)
-    out_of_stock_requests = await db.get_collection("out_of_stock_requests").find({}, {"_id": 0}).to_list(1000)
-    custom_requests = await db.get_collection("custom_requests").find({}, {"_id": 0}).to_list(1000)
+    purchase_requests = await repo.find(repo.purchase_requests, {})
+    out_of_stock_requests = await repo.find(repo.out_of_stock_requests, {})
+    custom_requests = await repo.find(repo.custom_requests, {})
     
     for req in purchase_requests:
         if isinstance(req.get('created_at'), str):
@@ -732,18 +1076,33 @@ async def get_all_requests(request: Request):
         "custom_requests": custom_requests
     }
 
+async def transition_request(collection, request_id: str, expected: list, new_status: str) -> dict:
+    """Move a request from one of the ``expected`` statuses to ``new_status`` in one atomic update.
+
+    Returns the request as it was before the update. Concurrent transitions on
+    the same request cannot both succeed, so side effects run exactly once.
+    """
+    previous = await collection.find_one_and_update(
+        {"id": request_id, "status": {"$in": expected}},
+        {"$set": {"status": new_status, f"{new_status}_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0}
+    )
+    if previous:
+        return previous
+    
+    # Only the failure path pays for telling "missing" apart from "already processed"
+    if not await repo.find_one(collection, {"id": request_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+    raise HTTPException(status_code=400, detail="La solicitud ya ha sido procesada")
+
 @api_router.put("/requests/purchase/{request_id}/complete")
 async def complete_purchase_request(request_id: str, request: Request):
     """Mark a purchase request as completed"""
     await require_admin(request)
     
-    result = await db.get_collection("purchase_requests").update_one(
-        {"id": request_id},
-        {"$set": {"status": "completed"}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+    previous = await transition_request(repo.purchase_requests, request_id, ["pending"], "completed")
+    await analytics.record_transition(repo, previous, "pending", "completed")
+    await popularity.record_purchased(repo, previous)
     
     return {"message": "Solicitud marcada como completada"}
 
@@ -752,25 +1111,11 @@ async def reject_purchase_request(request_id: str, request: Request):
     """Mark a purchase request as rejected and restitute stock"""
     await require_admin(request)
     
-    # Get the request first to know the quantity and product
-    purchase_request = await db.get_collection("purchase_requests").find_one({"id": request_id})
-    if not purchase_request:
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
-        
-    if purchase_request["status"] != "pending":
-        raise HTTPException(status_code=400, detail="La solicitud ya ha sido procesada")
+    previous = await transition_request(repo.purchase_requests, request_id, ["pending"], "rejected")
     
-    # Update request status
-    await db.get_collection("purchase_requests").update_one(
-        {"id": request_id},
-        {"$set": {"status": "rejected"}}
-    )
-    
-    # Restitute stock
-    await db.get_collection("products").update_one(
-        {"id": purchase_request["product_id"]},
-        {"$inc": {"stock": purchase_request["quantity"]}}
-    )
+    # Restitute stock (only the call that won the transition gets here)
+    await stock.release(repo, [previous])
+    await analytics.record_transition(repo, previous, "pending", "rejected")
     
     return {"message": "Solicitud rechazada y stock restituido"}
 
@@ -779,13 +1124,8 @@ async def complete_out_of_stock_request(request_id: str, request: Request):
     """Mark an out-of-stock request as completed"""
     await require_admin(request)
     
-    result = await db.get_collection("out_of_stock_requests").update_one(
-        {"id": request_id},
-        {"$set": {"status": "completed"}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+    # Requests created before statuses existed have none; "notified" ones were told about a restock
+    await transition_request(repo.out_of_stock_requests, request_id, ["pending", "notified", None], "completed")
     
     return {"message": "Solicitud marcada como completada"}
 
@@ -794,16 +1134,99 @@ async def complete_custom_request(request_id: str, request: Request):
     """Mark a custom request as completed"""
     await require_admin(request)
     
-    result = await db.get_collection("custom_requests").update_one(
-        {"id": request_id},
-        {"$set": {"status": "completed"}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+    await transition_request(repo.custom_requests, request_id, ["pending", None], "completed")
     
     return {"message": "Solicitud marcada como completada"}
 
+# ==================== ANALYTICS ROUTES ====================
+
+@api_router.get("/admin/analytics")
+async def get_analytics(request: Request, group_by: str = "day", start: Optional[str] = None,
+                        end: Optional[str] = None, status: Optional[str] = None):
+    """Revenue, units and request counts grouped by day, product, category or status (admin only)"""
+    await require_admin(request)
+    
+    if group_by not in analytics.GROUP_FIELDS:
+        raise HTTPException(status_code=400, detail="Agrupación inválida")
+    
+    return await analytics.query(repo, group_by, start=start, end=end, status=status)
+
+@api_router.post("/admin/analytics/rebuild")
+async def rebuild_analytics(request: Request):
+    """Recompute the sales rollup from all purchase requests (admin only)"""
+    await require_admin(request)
+    
+    await analytics.rebuild_rollup(repo)
+    return {"message": "Resumen de ventas recalculado"}
+
+# ==================== ARCHIVE ROUTES ====================
+
+@api_router.get("/admin/archive/{kind}")
+async def get_archived_requests(kind: str, request: Request, status: Optional[str] = None,
+                                start: Optional[str] = None, end: Optional[str] = None,
+                                skip: int = 0, limit: int = 100):
+    """Query archived requests (admin only)"""
+    await require_admin(request)
+    
+    if kind not in archiver.REQUEST_KINDS:
+        raise HTTPException(status_code=404, detail="Tipo de solicitud no encontrado")
+    
+    return await archiver.query_archive(repo, kind, status=status, start=start, end=end,
+                                        skip=max(skip, 0), limit=min(max(limit, 1), 500))
+
+@api_router.post("/admin/archive/run")
+async def run_archive(request: Request, days: Optional[int] = None):
+    """Archive finished requests now instead of waiting for the schedule (admin only)"""
+    await require_admin(request)
+    
+    moved = await archiver.run_archiver(repo, days)
+    return {"message": "Solicitudes archivadas", "archived": moved}
+
+# ==================== MAINTENANCE ROUTES ====================
+
+@api_router.post("/admin/stock/release-stale")
+async def release_stale_stock(request: Request):
+    """Expire stale pending purchase requests and give back their stock now (admin only)"""
+    await require_admin(request)
+    
+    return await reaper.release_stale_holds(repo)
+
+@api_router.post("/admin/related/compute")
+async def run_related_products(request: Request):
+    """Recompute "customers also asked for" now instead of waiting for the schedule (admin only)"""
+    await require_admin(request)
+    
+    products = await related.compute(repo)
+    return {"message": "Recomendaciones recalculadas", "products": products}
+
+@api_router.get("/admin/metrics")
+async def get_metrics(request: Request):
+    """Process counters of this worker (admin only)"""
+    await require_admin(request)
+    
+    return metrics.snapshot()
+
+# ==================== PROFILING ROUTES ====================
+
+@api_router.get("/admin/profiles")
+async def list_profiles(request: Request):
+    """Recent request profiles of this worker (admin only)"""
+    await require_admin(request)
+    
+    return profiling.buffer.list()
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request, format: str = "json"):
+    """A stored profile; format=folded returns collapsed stacks for flame graph tools (admin only)"""
+    await require_admin(request)
+    
+    profile = profiling.buffer.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return profile.to_dict()
+
 # ==================== CONFIG ROUTES ====================
 
 @api_router.get("/config")
@@ -811,28 +1234,46 @@ async def get_config(request: Request):
     """Get admin config"""
     await require_admin(request)
     
-    config = await db.get_collection("admin_config").find_one({}, {"_id": 0})
-    if not config:
-        # Return default
-        return {"email": "", "phone": ""}
-    return config
+    return admin_config.get()
 
 @api_router.put("/config")
 async def update_config(config_data: AdminConfig, request: Request):
     """Update admin config"""
     await require_admin(request)
     
-    await db.get_collection("admin_config").update_one(
-        {},
-        {"$set": config_data.model_dump()},
-        upsert=True
-    )
+    # Other workers pick the change up within CONFIG_POLL_SECONDS
+    await admin_config.update(config_data.model_dump())
     
     return config_data
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: warm-up finished, not shutting down, and MongoDB answers"""
+    if app.state.status != "ready":
+        return JSONResponse({"status": app.state.status}, status_code=503)
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=2)
+    except Exception:
+        return JSONResponse({"status": "database_unavailable"}, status_code=503)
+    return {"status": "ready"}
+
+async def can_profile(request: Request) -> bool:
+    """Only admins may profile requests (X-Profile: 1)"""
+    user = await get_current_user(request)
+    return bool(user and user.role == "admin")
+
+app.add_middleware(profiling.ProfileMiddleware, authorize=can_profile)
+
+app.add_middleware(compression.CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -841,13 +1282,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (queued, written off the event loop)
+configure_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def archive_finished_requests():
+    moved = await archiver.run_archiver(repo)
+    if any(moved.values()):
+        logger.info(f"Archived requests: {moved}")
+
+def rank_rebalance_seconds() -> int:
+    return int(os.environ.get('RANK_REBALANCE_INTERVAL_SECONDS', '3600'))
+
+async def rebalance_product_ranks():
+    if await ranking.needs_rebalance(repo):
+        updated = await ranking.rebalance(repo, rank_rebalance_seconds())
+        if updated:
+            logger.info(f"Rebalanced product ranks ({updated} updated)")
+
+async def release_stale_stock_holds():
+    released = await reaper.release_stale_holds(repo)
+    if released["expired"]:
+        logger.info(f"Expired stale purchase requests: {released}")
+
+async def decay_popularity():
+    await popularity.decay(repo)
+
+async def compute_related_products():
+    await related.compute_scheduled(repo)
+
+async def sync_suggest_index():
+    # Picks up product writes made by other workers
+    await suggest_index.sync(repo)
+
+scheduler.every(int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600')), archive_finished_requests)
+scheduler.every(int(os.environ.get('REAPER_INTERVAL_SECONDS', '600')), release_stale_stock_holds)
+scheduler.every(rank_rebalance_seconds(), rebalance_product_ranks)
+scheduler.every(config_service.poll_seconds(), admin_config.refresh, name="admin_config_refresh")
+scheduler.every(suggest.sync_seconds(), sync_suggest_index)
+scheduler.every(popularity.decay_interval_seconds(), decay_popularity)
+scheduler.every(related.interval_seconds(), compute_related_products)
+
+async def warm_up():
+    """Open connections and load what the first requests need, so they don't pay for it"""
+    started = time.perf_counter()
+    # Concurrent pings each check out a connection: the pool is open up to minPoolSize
+    await asyncio.gather(*[client.admin.command("ping") for _ in range(max(min_pool_size(), 1))])
+    catalog = await public_catalog(dict(VISIBLE_PRODUCTS), None)
+    await catalog.prepare()
+    await get_categories()
+    await admin_config.load()
+    await suggest_index.load(repo)
+    log_event(logger, "warm_up_completed", duration_ms=round((time.perf_counter() - started) * 1000, 2))
+
+async def startup():
+    await repo.ensure_indexes()
+    await idempotency_store.ensure_indexes()
+    await code_store.ensure_indexes()
+    await rate_limiter.ensure_indexes()
+    # Assigns ranks and versions to products created before they existed
+    await rebalance_product_ranks()
+    await catalog_versions.stamp_unversioned(repo)
+    await transcoder.resume_unfinished()
+    await warm_up()
+    scheduler.start()
+    app.state.status = "ready"
+
+async def shutdown():
+    app.state.status = "draining"
+    drain_seconds = float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '30'))
+    await scheduler.stop()
+    # Interrupted transcodes stay "processing" and are resumed on the next start
+    await transcoder.drain(timeout=drain_seconds)
+    await back_in_stock.drain(timeout=drain_seconds)
+    client.close()
+    shutdown_logging()
\ No newline at end of file
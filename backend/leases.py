@@ -0,0 +1,32 @@
+"""Single-runner claims for the maintenance jobs every worker schedules.
+
+Each job keeps one document in ``counters`` with the time of its last run. A
+worker claims a run with a conditional upsert that only matches when that time
+is at least one interval old; when another worker has already claimed the
+interval, the upsert collides with the existing document and the claim fails,
+so exactly one worker (across instances) runs the job per interval.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+async def claim_run(repo, job_id: str, interval_seconds: float, field: str = "last_run_at",
+                    now: Optional[datetime] = None) -> Optional[dict]:
+    """Claim this interval's run of ``job_id``.
+
+    Returns None when another worker has it, else the job's previous state
+    (``{}`` on the very first run), whose ``field`` holds the previous run time.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(seconds=interval_seconds)).isoformat()
+    try:
+        previous = await repo.counters.find_one_and_update(
+            {"_id": job_id, field: {"$lte": cutoff}},
+            {"$set": {field: now.isoformat()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The document exists with a recent run: another worker already ran this interval
+        return None
+    return previous or {}
@@ -0,0 +1,11 @@
+"""Process-wide counters exposed on the admin metrics endpoint."""
+from collections import defaultdict
+from typing import Dict
+
+_counters: Dict[str, float] = defaultdict(float)
+
+def inc(name: str, value: float = 1):
+    _counters[name] += value
+
+def snapshot() -> Dict[str, float]:
+    return dict(_counters)
@@ -0,0 +1,99 @@
+"""Popularity counters behind the "best sellers" catalog sort.
+
+One ``product_popularity`` document per product holds three counters: units
+requested in purchase requests, units in completed purchases, and units asked
+for through out-of-stock requests. The request routes keep them current with
+``$inc``, together with ``score``, their weighted sum, so the popular order is
+one read of the ``(score, product_id)`` index instead of an aggregation over
+``purchase_requests``.
+
+A scheduled job multiplies every counter by the same factor so old demand
+fades with a half-life of ``POPULARITY_HALF_LIFE_DAYS``. Every worker runs the
+job, so each run first claims the interval on a ``last_decay_at`` document
+with a conditional update; only the worker that wins applies the decay, scaled
+to the time actually elapsed since the previous one. The counters live
+outside the product documents: they change on every request and on every
+decay, and writing them to products would bump catalog versions and make
+every incremental-sync client download the whole catalog again.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+import leases
+from stock import merge_quantities, purchase_lines
+
+WEIGHTS = {"requested": 1.0, "purchased": 3.0, "interest": 0.5}
+# Decayed below this, a product no longer counts as popular
+MIN_SCORE = 0.01
+# Document in ``counters`` holding when the decay last ran
+DECAY_STATE_ID = "popularity_decay"
+
+def decay_interval_seconds() -> int:
+    return int(os.environ.get('POPULARITY_DECAY_INTERVAL_SECONDS', '3600'))
+
+def decay_factor(elapsed_seconds: float) -> float:
+    """Multiplier for ``elapsed_seconds`` of decay at the configured half-life"""
+    half_life = float(os.environ.get('POPULARITY_HALF_LIFE_DAYS', '30')) * 86400
+    return 0.5 ** (elapsed_seconds / half_life)
+
+def _increments(counter: str, quantities: Dict[str, int]) -> List[UpdateOne]:
+    return [
+        UpdateOne(
+            {"product_id": product_id},
+            {"$inc": {counter: quantity, "score": WEIGHTS[counter] * quantity}},
+            upsert=True,
+        )
+        for product_id, quantity in quantities.items()
+    ]
+
+async def record_requested(repo, purchase: dict):
+    """Count the units of a new purchase request"""
+    await repo.product_popularity.bulk_write(_increments("requested", merge_quantities(purchase_lines(purchase))), ordered=False)
+
+async def record_purchased(repo, purchase: dict):
+    """Count the units of a completed purchase request"""
+    await repo.product_popularity.bulk_write(_increments("purchased", merge_quantities(purchase_lines(purchase))), ordered=False)
+
+async def record_interest(repo, product_id: str, quantity: int):
+    """Count the units asked for in an out-of-stock request"""
+    await repo.product_popularity.bulk_write(_increments("interest", {product_id: quantity}))
+
+async def _claim_decay(repo, now: datetime) -> Optional[float]:
+    """Seconds since the last decay if this worker gets to run it, else None"""
+    previous = await leases.claim_run(repo, DECAY_STATE_ID, decay_interval_seconds(), "last_decay_at", now)
+    if not previous:
+        # Another worker has it, or first run ever (which only starts the clock)
+        return None
+    return (now - datetime.fromisoformat(previous["last_decay_at"])).total_seconds()
+
+async def decay(repo) -> int:
+    """Scheduled decay, applied by one worker per interval; returns products decayed"""
+    elapsed = await _claim_decay(repo, datetime.now(timezone.utc))
+    if elapsed is None:
+        return 0
+    return await apply_decay(repo, decay_factor(elapsed))
+
+async def apply_decay(repo, factor: float) -> int:
+    """Scale every counter by ``factor``; returns how many products still count"""
+    await repo.product_popularity.delete_many({"score": {"$lt": MIN_SCORE}})
+    result = await repo.product_popularity.update_many(
+        {"score": {"$gte": MIN_SCORE}},
+        [{"$set": {field: {"$multiply": [{"$ifNull": [f"${field}", 0]}, factor]} for field in [*WEIGHTS, "score"]}}]
+    )
+    return result.modified_count
+
+async def ranked_ids(repo) -> List[str]:
+    """Product ids from most to least popular (covered by the score index)"""
+    ranked = await repo.find(
+        repo.product_popularity, {"score": {"$gte": MIN_SCORE}}, {"_id": 0, "product_id": 1},
+        sort=[("score", -1), ("product_id", 1)], limit=None
+    )
+    return [entry["product_id"] for entry in ranked]
+
+def sort_popular(products: List[dict], ranked: List[str]) -> List[dict]:
+    """Order ``products`` by popularity; the rest keep their catalog order after them"""
+    position = {product_id: n for n, product_id in enumerate(ranked)}
+    return sorted(products, key=lambda product: position.get(product["id"], len(position)))
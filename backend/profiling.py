@@ -0,0 +1,185 @@
+"""Opt-in per-request profiling for admins.
+
+A request carrying ``X-Profile: 1`` (or ``?__profile=1``) from an admin runs with
+a sampling profiler attached to the event loop thread and with its MongoDB
+commands timed. The result (folded stacks, ready for flamegraph.pl or
+speedscope, plus the command timings) is kept in a bounded in-memory ring
+buffer. Requests without the trigger only pay for a header lookup, and the
+command listener returns immediately when no profile is active.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+from urllib.parse import parse_qs
+
+from pymongo import monitoring
+from starlette.requests import Request
+
+HEADER = "X-Profile"
+QUERY_PARAM = "__profile"
+
+current_profile: ContextVar[Optional["Profile"]] = ContextVar("current_profile", default=None)
+
+_HEADER_KEY = HEADER.lower().encode()
+_QUERY_KEY = QUERY_PARAM.encode()
+
+def is_requested(scope) -> bool:
+    """Whether the ASGI request asks to be profiled (reads the raw scope, builds nothing)"""
+    for name, value in scope["headers"]:
+        if name == _HEADER_KEY and value == b"1":
+            return True
+    query = scope.get("query_string", b"")
+    return _QUERY_KEY in query and parse_qs(query.decode("latin-1")).get(QUERY_PARAM) == ["1"]
+
+class Profile:
+    def __init__(self, method: str, path: str):
+        self.id = str(uuid.uuid4())
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.duration_ms = 0.0
+        self.status_code = None
+        self.stacks: Counter = Counter()
+        self.commands = []
+        self._pending = {}
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status_code": self.status_code,
+            "samples": sum(self.stacks.values()),
+            "mongo_commands": len(self.commands),
+            "mongo_ms": round(sum(c["duration_ms"] for c in self.commands), 3),
+        }
+
+    def folded(self) -> str:
+        """Collapsed stacks: ``frame;frame;frame count`` per line"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), "commands": self.commands, "folded": self.folded()}
+
+class StackSampler:
+    """Samples the stack of one thread every ``interval`` seconds from a helper thread"""
+
+    def __init__(self, thread_id: int, stacks: Counter, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.stacks = stacks
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+class CommandTimer(monitoring.CommandListener):
+    """Records MongoDB command timings for the profile active in the calling context"""
+
+    def started(self, event):
+        profile = current_profile.get()
+        if profile is None:
+            return
+        collection = event.command.get(event.command_name)
+        profile._pending[event.request_id] = collection if isinstance(collection, str) else None
+
+    def _finish(self, event, ok: bool):
+        profile = current_profile.get()
+        if profile is None:
+            return
+        profile.commands.append({
+            "command": event.command_name,
+            "collection": profile._pending.pop(event.request_id, None),
+            "duration_ms": event.duration_micros / 1000,
+            "ok": ok,
+        })
+
+    def succeeded(self, event):
+        self._finish(event, True)
+
+    def failed(self, event):
+        self._finish(event, False)
+
+class ProfileBuffer:
+    """The most recent profiles, oldest dropped first"""
+
+    def __init__(self, size: int):
+        self._profiles = deque(maxlen=size)
+
+    def add(self, profile: Profile):
+        self._profiles.append(profile)
+
+    def list(self) -> list:
+        return [profile.summary() for profile in reversed(self._profiles)]
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return next((profile for profile in self._profiles if profile.id == profile_id), None)
+
+buffer = ProfileBuffer(int(os.environ.get('PROFILE_BUFFER_SIZE', '20')))
+command_timer = CommandTimer()
+
+class ProfileMiddleware:
+    """Pure ASGI middleware: untriggered requests are passed straight to the app.
+
+    ``authorize`` decides (from the request headers and cookies) whether a
+    triggered request may be profiled.
+    """
+
+    def __init__(self, app, authorize: Callable[[Request], Awaitable[bool]]):
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not await self.authorize(Request(scope)):
+            await self.app(scope, receive, send)
+            return
+        await self._profiled(scope, receive, send)
+
+    async def _profiled(self, scope, receive, send):
+        """Run the rest of the request under the sampler and store the result"""
+        profile = Profile(scope["method"], scope["path"])
+        sampler = StackSampler(threading.get_ident(), profile.stacks)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        token = current_profile.set(profile)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop()
+            profile.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            current_profile.reset(token)
+            buffer.add(profile)
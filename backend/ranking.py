@@ -0,0 +1,162 @@
+"""Fractional (lexicographic) ranks for the product display order.
+
+Products are sorted by a ``rank`` string. A key can always be generated between
+any two existing keys, so moving one product is a single write. Keys grow when
+many products are inserted at the same spot; ``rebalance`` periodically
+rewrites them as short, evenly spaced keys. One worker runs it per interval,
+and each rewrite only applies if the product still has the rank it read, so a
+product moved meanwhile keeps its move.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import leases
+from catalog_versions import next_stamps, stamped
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+# Keys longer than this trigger a rebalance
+MAX_RANK_LENGTH = 12
+# Document in ``counters`` holding when the rebalance last ran
+REBALANCE_STATE_ID = "rank_rebalance"
+
+def rank_between(lo: Optional[str], hi: Optional[str]) -> str:
+    """Return a key strictly between ``lo`` and ``hi`` (None means unbounded)"""
+    lo = lo or ""
+    if hi is not None and hi <= lo:
+        raise ValueError(f"Invalid rank interval: {lo!r} >= {hi!r}")
+
+    result = []
+    i = 0
+    while True:
+        a = DIGITS.index(lo[i]) if i < len(lo) else 0
+        b = DIGITS.index(hi[i]) if hi is not None and i < len(hi) else BASE
+        if a == b:
+            result.append(DIGITS[a])
+        else:
+            mid = (a + b) // 2
+            if mid > a:
+                result.append(DIGITS[mid])
+                return "".join(result)
+            # Adjacent digits: keep lo's digit, anything after it is below hi
+            result.append(DIGITS[a])
+            hi = None
+        i += 1
+
+def spaced_ranks(count: int) -> List[str]:
+    """``count`` short keys spread evenly over the key space"""
+    width = 1
+    while BASE ** width <= count:
+        width += 1
+    step = BASE ** width // (count + 1)
+    ranks = []
+    for n in range(1, count + 1):
+        value = n * step
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        ranks.append("".join(reversed(digits)).rstrip("0"))
+    return ranks
+
+def increasing_positions(ranks: List[Optional[str]]) -> set:
+    """Positions of a longest strictly increasing run of ``ranks`` (those can be kept)"""
+    tails: List[str] = []
+    tail_positions: List[int] = []
+    previous = [-1] * len(ranks)
+    for position, rank in enumerate(ranks):
+        if rank is None:
+            continue
+        k = bisect_left(tails, rank)
+        if k == len(tails):
+            tails.append(rank)
+            tail_positions.append(position)
+        else:
+            tails[k] = rank
+            tail_positions[k] = position
+        previous[position] = tail_positions[k - 1] if k > 0 else -1
+
+    keep = set()
+    position = tail_positions[-1] if tail_positions else -1
+    while position != -1:
+        keep.add(position)
+        position = previous[position]
+    return keep
+
+def reorder_ranks(ids: List[str], ranks: List[Optional[str]]) -> List[Tuple[str, str]]:
+    """(id, new rank) pairs that make ``ids`` sorted in list order, rewriting as few ranks as possible"""
+    keep = increasing_positions(ranks)
+    changes = []
+    lo = None
+    position = 0
+    while position < len(ids):
+        if position in keep:
+            lo = ranks[position]
+            position += 1
+            continue
+        # Run of products to re-rank, bounded by the next kept rank
+        end = position
+        while end < len(ids) and end not in keep:
+            end += 1
+        hi = ranks[end] if end < len(ids) else None
+        for run_position in range(position, end):
+            lo = rank_between(lo, hi)
+            changes.append((ids[run_position], lo))
+        position = end
+    return changes
+
+async def apply_ranks(repo, changes: List[Tuple[str, str]], read_ranks: Optional[Dict[str, Optional[str]]] = None) -> int:
+    """Write new ranks with one bulk write, stamping each product with a catalog version.
+
+    With ``read_ranks`` (id -> rank it was computed from) a product is only
+    updated if its rank is still that one. Returns how many products were updated.
+    """
+    if not changes:
+        return 0
+    stamps = await next_stamps(repo, len(changes))
+    result = await repo.products.bulk_write(
+        [
+            UpdateOne(
+                {"id": product_id} if read_ranks is None else {"id": product_id, "rank": read_ranks[product_id]},
+                stamped({"$set": {"rank": rank}}, stamp)
+            )
+            for (product_id, rank), stamp in zip(changes, stamps)
+        ],
+        ordered=False
+    )
+    return result.matched_count
+
+async def needs_rebalance(repo) -> bool:
+    stale = await repo.products.find_one(
+        {"$or": [
+            {"rank": None},
+            {"$expr": {"$gt": [{"$strLenCP": {"$ifNull": ["$rank", ""]}}, MAX_RANK_LENGTH]}},
+        ]},
+        {"_id": 1}
+    )
+    return stale is not None
+
+async def rebalance(repo, interval_seconds: float) -> int:
+    """Rewrite all ranks as evenly spaced keys, keeping the current order.
+
+    Products without a rank (created before ranks existed) go after ranked ones,
+    in their legacy ``display_order``. Returns how many products were updated
+    (0 when another worker ran it within ``interval_seconds``).
+    """
+    if await leases.claim_run(repo, REBALANCE_STATE_ID, interval_seconds) is None:
+        return 0
+    products = await repo.products.find(
+        {}, {"_id": 0, "id": 1, "rank": 1, "display_order": 1, "created_at": 1}
+    ).to_list(None)
+    products.sort(key=lambda p: (
+        p.get("rank") is None, p.get("rank") or "", p.get("display_order", 0), str(p.get("created_at", ""))
+    ))
+
+    changes = [
+        (product["id"], rank)
+        for product, rank in zip(products, spaced_ranks(len(products)))
+        if product.get("rank") != rank
+    ]
+    return await apply_ranks(repo, changes, {product["id"]: product.get("rank") for product in products})
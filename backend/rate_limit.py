@@ -0,0 +1,143 @@
+"""Token-bucket rate limiting for the public write endpoints.
+
+Each key (client IP, phone number) owns a bucket of ``burst`` tokens refilled
+at ``per_minute`` tokens per minute; a request spends one token or is rejected
+with 429 and ``Retry-After``. The default memory backend keeps two numbers per
+key in a bounded LRU table per worker; ``RATE_LIMIT_BACKEND=mongo`` shares the
+buckets across workers through one atomic update per check.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+class MemoryTokenBuckets:
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 100000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def take(self, key: str) -> float:
+        """Spend a token; returns 0 when allowed, else seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                # Forgetting the least recently seen key only ever resets it to a full bucket
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / self.rate
+
+class MongoTokenBuckets:
+    """Buckets shared by all workers; idle buckets are removed by a TTL index"""
+
+    def __init__(self, collection, prefix: str, per_minute: float, burst: int):
+        self.collection = collection
+        self.prefix = prefix
+        self.rate = per_minute / 60
+        self.burst = burst
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("expires_at", 1)], expireAfterSeconds=0)
+
+    async def take(self, key: str) -> float:
+        now = time.time()
+        # Seconds for an empty bucket to refill; after that the document is just a full bucket
+        idle_ms = int(self.burst / self.rate * 1000)
+        bucket = await self.collection.find_one_and_update(
+            {"_id": f"{self.prefix}:{key}"},
+            [
+                {"$set": {
+                    "tokens": {"$min": [self.burst, {"$add": [
+                        {"$ifNull": ["$tokens", self.burst]},
+                        {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, self.rate]},
+                    ]}]},
+                    "ts": now,
+                    "expires_at": {"$add": ["$$NOW", idle_ms]},
+                }},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                }},
+            ],
+            projection={"_id": 0, "tokens": 1, "allowed": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0
+        return (1 - bucket["tokens"]) / self.rate
+
+def client_ip(request: Request) -> str:
+    """Client address; behind ``RATE_LIMIT_PROXY_HOPS`` proxies, taken from X-Forwarded-For.
+
+    Defaults to no proxy: without one in front, X-Forwarded-For comes from the
+    client and trusting it would let anyone pick a fresh bucket per request.
+    """
+    hops = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '0'))
+    forwarded = request.headers.get("X-Forwarded-For")
+    if hops > 0 and forwarded:
+        # Entries appended by our own proxies are trustworthy, the client-supplied prefix is not
+        addresses = [address.strip() for address in forwarded.split(",")]
+        return addresses[max(len(addresses) - hops, 0)]
+    return request.client.host if request.client else "unknown"
+
+class RateLimiter:
+    """FastAPI dependency limiting by client IP and, when present, the phone in the body"""
+
+    def __init__(self, collection=None):
+        ip_rate = float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '30'))
+        ip_burst = int(os.environ.get('RATE_LIMIT_IP_BURST', '10'))
+        phone_rate = float(os.environ.get('RATE_LIMIT_PHONE_PER_MINUTE', '5'))
+        phone_burst = int(os.environ.get('RATE_LIMIT_PHONE_BURST', '5'))
+        self.enabled = os.environ.get('RATE_LIMIT_ENABLED', 'true') == 'true'
+
+        if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'mongo' and collection is not None:
+            self.by_ip = MongoTokenBuckets(collection, "ip", ip_rate, ip_burst)
+            self.by_phone = MongoTokenBuckets(collection, "phone", phone_rate, phone_burst)
+        else:
+            self.by_ip = MemoryTokenBuckets(ip_rate, ip_burst)
+            self.by_phone = MemoryTokenBuckets(phone_rate, phone_burst)
+
+    async def ensure_indexes(self):
+        if isinstance(self.by_ip, MongoTokenBuckets):
+            await self.by_ip.ensure_indexes()
+
+    @staticmethod
+    def _reject(retry_after: float):
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas solicitudes, intenta de nuevo más tarde",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    async def __call__(self, request: Request):
+        if not self.enabled:
+            return
+
+        retry_after = await self.by_ip.take(client_ip(request))
+        if retry_after:
+            self._reject(retry_after)
+
+        try:
+            body = await request.json()
+        except ValueError:
+            return
+        phone = (body.get("phone") or body.get("user_phone")) if isinstance(body, dict) else None
+        if phone:
+            retry_after = await self.by_phone.take(str(phone))
+            if retry_after:
+                self._reject(retry_after)
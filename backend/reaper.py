@@ -0,0 +1,57 @@
+"""Releases stock held by abandoned purchase requests.
+
+Pending requests older than ``PURCHASE_HOLD_HOURS`` are marked ``expired`` and
+their stock is given back. Each batch is claimed with one conditional
+``update_many`` (still ``pending`` + a unique claim token), so a request that an
+admin completes or rejects concurrently is never released twice.
+"""
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import analytics
+import metrics
+import stock
+
+def hold_hours() -> float:
+    return float(os.environ.get('PURCHASE_HOLD_HOURS', '72'))
+
+def batch_size() -> int:
+    return int(os.environ.get('REAPER_BATCH_SIZE', '200'))
+
+async def release_stale_holds(repo) -> dict:
+    """Expire stale pending requests in batches; returns requests and units reclaimed"""
+    now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(hours=hold_hours())).isoformat()
+    size = batch_size()
+    query = {"status": "pending", "created_at": {"$lt": cutoff}}
+
+    expired = 0
+    units = 0
+    while True:
+        candidates = await repo.purchase_requests.find(query, {"_id": 0, "id": 1}) \
+            .sort("created_at", 1).limit(size).to_list(size)
+        if not candidates:
+            break
+
+        claim = str(uuid.uuid4())
+        await repo.purchase_requests.update_many(
+            {"id": {"$in": [c["id"] for c in candidates]}, "status": "pending"},
+            {"$set": {"status": "expired", "expired_at": now.isoformat(), "expiry_claim": claim}}
+        )
+        claimed = await repo.purchase_requests.find({"expiry_claim": claim}, {"_id": 0}).to_list(None)
+
+        if claimed:
+            await stock.release(repo, claimed)
+            for purchase in claimed:
+                await analytics.record_transition(repo, purchase, "pending", "expired")
+                units += sum(line["quantity"] for line in stock.purchase_lines(purchase))
+            expired += len(claimed)
+
+        if len(candidates) < size:
+            break
+
+    metrics.inc("stock_reaper_runs")
+    metrics.inc("stock_reaper_requests_expired", expired)
+    metrics.inc("stock_reaper_units_reclaimed", units)
+    return {"expired": expired, "units_reclaimed": units}
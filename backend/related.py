@@ -0,0 +1,159 @@
+"""Precomputed "customers also asked for" recommendations.
+
+A batch job counts how often two products were requested by the same
+customer (phone, or email when there is no phone) across ``purchase_requests``
+and its archive. Requests are streamed from the database in batches and reduced
+to one basket of product indices per customer. Baskets are then counted in
+chunks of ``RELATED_CHUNK_SIZE`` customers: every product pair in a chunk is
+encoded as one int64 (``first * n + second``) and counted with ``numpy.unique``,
+and each chunk's counts are merged into the running totals. Memory therefore
+grows with the number of distinct pairs, not with the number of requests.
+
+The ``RELATED_TOP_K`` most frequent neighbors of each product are stored in
+``related_products``, so the endpoint reads one document per product. Every
+worker schedules the job, but ``compute_scheduled`` first claims the interval
+(see ``leases``), so the counting runs once per interval, not once per worker.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+from pymongo import ReplaceOne
+
+import leases
+from logging_setup import log_event
+from stock import purchase_lines
+
+logger = logging.getLogger(__name__)
+
+# A customer asking for more than this many products adds no useful signal per pair
+MAX_BASKET = 50
+WRITE_BATCH = 500
+# Document in ``counters`` holding when the scheduled computation last ran
+COMPUTE_STATE_ID = "related_products"
+
+def top_k() -> int:
+    return int(os.environ.get('RELATED_TOP_K', '8'))
+
+def min_support() -> int:
+    return max(1, int(os.environ.get('RELATED_MIN_SUPPORT', '1')))
+
+def chunk_size() -> int:
+    return max(1, int(os.environ.get('RELATED_CHUNK_SIZE', '5000')))
+
+def interval_seconds() -> int:
+    return int(os.environ.get('RELATED_INTERVAL_SECONDS', '86400'))
+
+def _customer(request: dict) -> str:
+    phone = "".join(c for c in request.get("user_phone") or "" if c.isdigit())
+    return phone or (request.get("user_email") or "").strip().lower()
+
+async def load_baskets(repo) -> Tuple[List[str], List[Set[int]]]:
+    """Product ids, and the set of product indices each customer asked for"""
+    products: Dict[str, int] = {}
+    baskets: Dict[str, Set[int]] = {}
+    projection = {"_id": 0, "user_phone": 1, "user_email": 1, "product_id": 1, "items.product_id": 1}
+    for collection in (repo.purchase_requests, repo.purchase_requests_archive):
+        async for request in collection.find({}, projection, batch_size=chunk_size()):
+            customer = _customer(request)
+            if not customer:
+                continue
+            basket = baskets.setdefault(customer, set())
+            for line in purchase_lines(request):
+                if line.get("product_id") and len(basket) < MAX_BASKET:
+                    basket.add(products.setdefault(line["product_id"], len(products)))
+    return list(products), [basket for basket in baskets.values() if len(basket) > 1]
+
+def _pair_keys(baskets: List[Set[int]], n: int) -> np.ndarray:
+    """Every unordered product pair in ``baskets``, encoded as ``first * n + second``"""
+    by_size: Dict[int, List[List[int]]] = {}
+    for basket in baskets:
+        by_size.setdefault(len(basket), []).append(sorted(basket))
+    keys = []
+    # Baskets of one size form a matrix: all their pairs come from one indexing operation
+    for size, rows in by_size.items():
+        items = np.array(rows, dtype=np.int64)
+        first, second = np.triu_indices(size, k=1)
+        keys.append((items[:, first] * n + items[:, second]).ravel())
+    return np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+
+def count_pairs(baskets: List[Set[int]], n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct pair keys and how many customers asked for each pair"""
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    size = chunk_size()
+    for start in range(0, len(baskets), size):
+        chunk_keys, chunk_counts = np.unique(_pair_keys(baskets[start:start + size], n), return_counts=True)
+        keys, inverse = np.unique(np.concatenate([keys, chunk_keys]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([counts, chunk_counts])).astype(np.int64)
+    return keys, counts
+
+def top_neighbors(keys: np.ndarray, counts: np.ndarray, n: int, k: int, support: int) -> Dict[int, List[Tuple[int, int]]]:
+    """The ``k`` most frequent neighbors of every product, as (product index, count)"""
+    keep = counts >= support
+    keys, counts = keys[keep], counts[keep]
+    # Each pair is a neighbor in both directions
+    source = np.concatenate([keys // n, keys % n])
+    target = np.concatenate([keys % n, keys // n])
+    counts = np.concatenate([counts, counts])
+    # By source, then most frequent first (ties by index, for stable results)
+    order = np.lexsort((target, -counts, source))
+    source, target, counts = source[order], target[order], counts[order]
+
+    neighbors: Dict[int, List[Tuple[int, int]]] = {}
+    if not len(source):
+        return neighbors
+    starts = np.flatnonzero(np.r_[True, source[1:] != source[:-1]])
+    ends = np.r_[starts[1:], len(source)]
+    for start, end in zip(starts, ends):
+        end = min(end, start + k)
+        neighbors[int(source[start])] = list(zip(target[start:end].tolist(), counts[start:end].tolist()))
+    return neighbors
+
+async def compute_scheduled(repo) -> int:
+    """Scheduled ``compute``, run by one worker per interval; returns products computed"""
+    if await leases.claim_run(repo, COMPUTE_STATE_ID, interval_seconds()) is None:
+        return 0
+    return await compute(repo)
+
+async def compute(repo) -> int:
+    """Recompute ``related_products``; returns how many products have neighbors"""
+    started = time.perf_counter()
+    computed_at = datetime.now(timezone.utc).isoformat()
+    product_ids, baskets = await load_baskets(repo)
+    n = len(product_ids)
+
+    def crunch():
+        keys, counts = count_pairs(baskets, n)
+        return len(keys), top_neighbors(keys, counts, n, top_k(), min_support())
+
+    # CPU-bound: keep the event loop serving requests meanwhile
+    pairs, neighbors = await asyncio.to_thread(crunch)
+
+    operations = [
+        ReplaceOne(
+            {"product_id": product_ids[source]},
+            {
+                "product_id": product_ids[source],
+                "related": [{"product_id": product_ids[target], "count": count} for target, count in targets],
+                "computed_at": computed_at,
+            },
+            upsert=True,
+        )
+        for source, targets in neighbors.items()
+    ]
+    for start in range(0, len(operations), WRITE_BATCH):
+        await repo.related_products.bulk_write(operations[start:start + WRITE_BATCH], ordered=False)
+    # Products that lost all their neighbors
+    await repo.related_products.delete_many({"computed_at": {"$lt": computed_at}})
+
+    log_event(
+        logger, "related_products_computed",
+        customers=len(baskets), products=len(neighbors), pairs=pairs,
+        duration_ms=round((time.perf_counter() - started) * 1000, 2)
+    )
+    return len(neighbors)
@@ -0,0 +1,191 @@
+"""MongoDB data-access layer.
+
+Every route goes through a ``Repository`` instead of calling
+``db.get_collection(...)`` directly, so pool sizing, wire compression, read
+preferences, per-operation time limits and projections live in one place.
+"""
+import os
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference
+from pymongo.server_api import ServerApi
+
+# ==================== PROJECTIONS ====================
+
+NO_ID = {"_id": 0}
+# Only what the request routes need to validate stock and price a request
+PRODUCT_STOCK_PROJECTION = {"_id": 0, "id": 1, "name": 1, "price": 1, "stock": 1, "category": 1, "is_visible": 1}
+SESSION_PROJECTION = {"_id": 0, "user_id": 1, "expires_at": 1}
+
+# Products created before the visibility flag existed count as visible
+VISIBLE_PRODUCTS = {"$or": [{"is_visible": True}, {"is_visible": {"$exists": False}}]}
+
+# ==================== CLIENT ====================
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def min_pool_size() -> int:
+    return _env_int('MONGO_MIN_POOL_SIZE', 5)
+
+def create_client(mongo_url: str, event_listeners: Optional[list] = None) -> AsyncIOMotorClient:
+    """Create the Motor client with the pool and compression settings from the environment"""
+    # Defaults to the compressors requirements.txt ships (zstandard; zlib is built in).
+    # Others the driver cannot load (e.g. snappy without python-snappy) are skipped with a warning
+    compressors = os.environ.get('MONGO_COMPRESSORS', 'zstd,zlib')
+    return AsyncIOMotorClient(
+        mongo_url,
+        # Tls will be true, if the environment is production
+        tls=os.environ.get('ENVIRONMENT') == 'production',
+        server_api=ServerApi('1'),
+        maxPoolSize=_env_int('MONGO_MAX_POOL_SIZE', 100),
+        minPoolSize=min_pool_size(),
+        compressors=compressors,
+        zlibCompressionLevel=_env_int('MONGO_ZLIB_LEVEL', 6),
+        event_listeners=event_listeners or [],
+    )
+
+# ==================== REPOSITORY ====================
+
+class Repository:
+    """Collection handles and the read queries used by the API"""
+
+    def __init__(self, database, max_time_ms: Optional[int] = None):
+        self.db = database
+        self.max_time_ms = max_time_ms if max_time_ms is not None else _env_int('MONGO_MAX_TIME_MS', 5000)
+
+        # Catalog reads tolerate slightly stale data and can be served by secondaries.
+        # Stock checks, writes and read-after-write go to the primary.
+        self.catalog = database.get_collection("products", read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.products = database.get_collection("products", read_preference=ReadPreference.PRIMARY)
+
+        self.users = database.get_collection("users")
+        self.sessions = database.get_collection("user_sessions")
+
+        self.purchase_requests = database.get_collection("purchase_requests")
+        self.out_of_stock_requests = database.get_collection("out_of_stock_requests")
+        self.custom_requests = database.get_collection("custom_requests")
+        self.purchase_requests_archive = database.get_collection("purchase_requests_archive")
+        self.out_of_stock_requests_archive = database.get_collection("out_of_stock_requests_archive")
+        self.custom_requests_archive = database.get_collection("custom_requests_archive")
+
+        self.verified_phones = database.get_collection("verified_phones")
+        self.pending_verifications = database.get_collection("pending_verifications")
+        self.admin_config = database.get_collection("admin_config")
+
+        self.sales_daily = database.get_collection("sales_daily")
+        self.product_popularity = database.get_collection("product_popularity")
+        self.related_products = database.get_collection("related_products", read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.idempotency_keys = database.get_collection("idempotency_keys")
+        self.rate_limits = database.get_collection("rate_limits")
+        self.counters = database.get_collection("counters")
+        self.product_tombstones = database.get_collection("product_tombstones")
+
+    async def ensure_indexes(self):
+        """Create the indexes the queries below rely on (no-op when they exist)"""
+        await self.products.create_index([("id", 1)], unique=True)
+        await self.products.create_index([("rank", 1)])
+        await self.products.create_index([("category", 1), ("rank", 1)])
+        await self.products.create_index([("version", 1)])
+        await self.product_tombstones.create_index([("id", 1)], unique=True)
+        await self.product_tombstones.create_index([("version", 1)])
+        await self.sales_daily.create_index([("day", 1)])
+        await self.product_popularity.create_index([("product_id", 1)], unique=True)
+        await self.product_popularity.create_index([("score", -1), ("product_id", 1)])
+        await self.related_products.create_index([("product_id", 1)], unique=True)
+        await self.related_products.create_index([("computed_at", 1)])
+        await self.users.create_index([("id", 1)], unique=True)
+        await self.users.create_index([("email", 1)])
+        await self.sessions.create_index([("session_token", 1)], unique=True)
+        await self.verified_phones.create_index([("phone", 1)])
+
+        for hot, archive in [
+            (self.purchase_requests, self.purchase_requests_archive),
+            (self.out_of_stock_requests, self.out_of_stock_requests_archive),
+            (self.custom_requests, self.custom_requests_archive),
+        ]:
+            await hot.create_index([("id", 1)], unique=True)
+            await hot.create_index([("status", 1), ("created_at", 1)])
+            await archive.create_index([("id", 1)], unique=True)
+            await archive.create_index([("status", 1), ("created_at", -1)])
+            await archive.create_index([("created_at", -1)])
+        await self.purchase_requests.create_index([("expiry_claim", 1)], sparse=True)
+        await self.out_of_stock_requests.create_index([("product_id", 1), ("status", 1)])
+
+    # ---------- generic ----------
+
+    async def find_one(self, collection, query: dict, projection: Optional[dict] = NO_ID, **kwargs) -> Optional[dict]:
+        return await collection.find_one(query, projection, max_time_ms=self.max_time_ms, **kwargs)
+
+    async def find(self, collection, query: dict, projection: Optional[dict] = NO_ID,
+                   sort: Optional[list] = None, limit: int = 1000) -> List[dict]:
+        cursor = collection.find(query, projection, max_time_ms=self.max_time_ms)
+        if sort:
+            cursor = cursor.sort(sort)
+        return await cursor.to_list(limit)
+
+    # ---------- products ----------
+
+    async def list_products(self, query: dict, limit: int = 1000, primary: bool = False) -> List[dict]:
+        collection = self.products if primary else self.catalog
+        return await self.find(collection, query, NO_ID, sort=[("rank", 1)], limit=limit)
+
+    async def get_product(self, product_id: str, projection: Optional[dict] = NO_ID, primary: bool = False) -> Optional[dict]:
+        collection = self.products if primary else self.catalog
+        return await self.find_one(collection, {"id": product_id}, projection)
+
+    async def get_products_by_ids(self, product_ids: List[str]) -> List[dict]:
+        return await self.find(self.catalog, {"id": {"$in": product_ids}}, NO_ID, limit=len(product_ids))
+
+    async def category_facets(self) -> List[dict]:
+        """Visible product count and price range per category"""
+        pipeline = [
+            {"$match": {**VISIBLE_PRODUCTS, "category": {"$nin": [None, ""]}}},
+            {"$group": {
+                "_id": "$category",
+                "count": {"$sum": 1},
+                "min_price": {"$min": "$price"},
+                "max_price": {"$max": "$price"},
+            }},
+            {"$sort": {"_id": 1}},
+            {"$project": {"_id": 0, "category": "$_id", "count": 1, "min_price": 1, "max_price": 1}},
+        ]
+        return await self.catalog.aggregate(pipeline, maxTimeMS=self.max_time_ms).to_list(None)
+
+    async def related_products_of(self, product_id: str) -> List[dict]:
+        """Visible precomputed neighbors of a product, most related first (one round trip)"""
+        pipeline = [
+            {"$match": {"product_id": product_id}},
+            # Served by the products.id index; deleted products simply don't join
+            {"$lookup": {
+                "from": "products", "localField": "related.product_id", "foreignField": "id", "as": "products",
+            }},
+            {"$project": {"_id": 0, "related": 1, "products": 1}},
+        ]
+        found = await self.related_products.aggregate(pipeline, maxTimeMS=self.max_time_ms).to_list(1)
+        if not found:
+            return []
+        products = {product["id"]: product for product in found[0]["products"] if product.get("is_visible", True)}
+        return [products[entry["product_id"]] for entry in found[0]["related"] if entry["product_id"] in products]
+
+    async def max_rank(self) -> Optional[str]:
+        # Covered by the rank index: reads a single index entry
+        product = await self.find_one(self.products, {}, {"_id": 0, "rank": 1}, sort=[("rank", -1)])
+        return product.get("rank") if product else None
+
+    async def neighbor_rank(self, rank: str, exclude_id: str, before: bool) -> Optional[str]:
+        """Rank of the product right before (or after) ``rank``, ignoring ``exclude_id``"""
+        query = {"rank": {"$lt": rank} if before else {"$gt": rank}, "id": {"$ne": exclude_id}}
+        sort = [("rank", -1 if before else 1)]
+        product = await self.find_one(self.products, query, {"_id": 0, "rank": 1}, sort=sort)
+        return product.get("rank") if product else None
+
+    # ---------- users / sessions ----------
+
+    async def get_session(self, session_token: str) -> Optional[dict]:
+        return await self.find_one(self.sessions, {"session_token": session_token}, SESSION_PROJECTION)
+
+    async def get_user(self, query: dict) -> Optional[dict]:
+        return await self.find_one(self.users, query)
@@ -0,0 +1,38 @@
+"""Minimal in-process scheduler for periodic maintenance jobs."""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class Scheduler:
+    """Runs registered coroutines every N seconds on the event loop"""
+
+    def __init__(self):
+        self._jobs: List[Tuple[str, float, Callable[[], Awaitable]]] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def every(self, seconds: float, func: Callable[[], Awaitable], name: str = None):
+        """Register ``func`` to run every ``seconds`` (disabled when seconds <= 0)"""
+        if seconds > 0:
+            self._jobs.append((name or func.__name__, seconds, func))
+
+    async def _loop(self, name: str, seconds: float, func: Callable[[], Awaitable]):
+        while True:
+            await asyncio.sleep(seconds)
+            try:
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduled job {name} failed: {str(e)}")
+
+    def start(self):
+        for name, seconds, func in self._jobs:
+            self._tasks.append(asyncio.create_task(self._loop(name, seconds, func), name=name))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
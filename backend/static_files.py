@@ -0,0 +1,189 @@
+"""Serving of locally stored uploads (the ``/uploads`` mount).
+
+Uploads are stored under content-addressed names (a hash of the bytes), so a
+name never changes meaning and can be cached forever (``immutable``). Files
+under legacy names get a short revalidating cache lifetime instead.
+``UploadFiles`` also answers single ``Range`` requests (video seeking), serves
+``.br``/``.gz`` sidecars to clients that accept them, and can hand the actual
+transfer to a front proxy (``X-Accel-Redirect`` for nginx, ``X-Sendfile`` for
+Apache/lighttpd) so the worker only does the lookup.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from compression import INCOMPRESSIBLE_TYPES, add_vary, brotli, min_size, negotiate, static_level
+
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{32}(\.[a-z0-9]{1,8})?$")
+WRITE_ONCE_DIR = re.compile(r"^[0-9a-f]{32}$")  # Video rendition directories, see transcoder.py
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=300, must-revalidate"
+SIDECARS = {"br": ".br", "gzip": ".gz"}
+
+# HLS renditions
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+
+def content_addressed_name(content: bytes, filename: str) -> str:
+    """``<hash><ext>``: same bytes, same name"""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,8}", ext):
+        ext = ""
+    return hashlib.sha256(content).hexdigest()[:32] + ext
+
+def save_upload(directory: Path, content: bytes, filename: str, content_type: Optional[str]) -> str:
+    """Store an upload under its content-addressed name; returns the name.
+
+    Compressible files also get ``.gz`` (and ``.br`` when brotli is installed)
+    sidecars so they are never compressed per request. Blocking (file writes,
+    compression at the ``COMPRESSION_STATIC_*`` levels): call it from a thread.
+    """
+    name = content_addressed_name(content, filename)
+    path = directory / name
+    if path.exists():
+        return name
+    # Write-then-rename: a concurrent reader never sees a partial file under the final name
+    partial = directory / f".{name}.partial"
+    partial.write_bytes(content)
+    os.replace(partial, path)
+
+    if len(content) >= min_size() and not (content_type or "").startswith(INCOMPRESSIBLE_TYPES):
+        (directory / (name + ".gz")).write_bytes(gzip.compress(content, static_level("gzip")))
+        if brotli is not None:
+            (directory / (name + ".br")).write_bytes(brotli.compress(content, quality=static_level("br")))
+    return name
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single ``bytes=`` range.
+
+    Returns None when the header should be ignored (malformed or multiple
+    ranges: the full file is sent) and raises ValueError when it cannot be
+    satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = (part.strip() for part in spec.strip().partition("-"))
+    if not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+class FileRangeResponse(FileResponse):
+    """206 response with one byte range of a file"""
+
+    def __init__(self, path, start: int, end: int, size: int, **kwargs):
+        headers = {
+            **kwargs.pop("headers", {}),
+            "content-range": f"bytes {start}-{end}/{size}",
+            "content-length": str(end - start + 1),
+        }
+        super().__init__(path, status_code=206, headers=headers, **kwargs)
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.end - self.start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining = remaining - len(chunk) if chunk else 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+class UploadFiles(StaticFiles):
+    def __init__(self, *args, offload: Optional[str] = None, offload_prefix: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # '', 'x-accel-redirect' (nginx internal location) or 'x-sendfile' (absolute path)
+        self.offload = (offload if offload is not None else os.environ.get('UPLOADS_OFFLOAD', '')).lower()
+        self.offload_prefix = offload_prefix or os.environ.get('UPLOADS_OFFLOAD_PREFIX', '/protected-uploads/')
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        directory, name = os.path.split(full_path)
+        immutable = CONTENT_ADDRESSED.match(name) or WRITE_ONCE_DIR.match(os.path.basename(directory))
+        headers = {
+            "cache-control": IMMUTABLE if immutable else REVALIDATE,
+            "accept-ranges": "bytes",
+        }
+        response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        if self.offload:
+            return self._offloaded(full_path, response)
+
+        if status_code == 200 and "range" in request_headers and self._range_applies(response, request_headers):
+            try:
+                byte_range = parse_range(request_headers["range"], stat_result.st_size)
+            except ValueError:
+                return Response(status_code=416, headers={"content-range": f"bytes */{stat_result.st_size}"})
+            if byte_range is not None:
+                return FileRangeResponse(
+                    full_path, *byte_range, stat_result.st_size, headers=headers, stat_result=stat_result,
+                    media_type=response.media_type,
+                )
+
+        if not response.media_type.startswith(INCOMPRESSIBLE_TYPES):
+            add_vary(response.headers)
+            sidecar = self._sidecar(full_path, request_headers)
+            if sidecar is not None:
+                encoding, path, sidecar_stat = sidecar
+                return FileResponse(
+                    path, status_code=status_code, stat_result=sidecar_stat, media_type=response.media_type,
+                    headers={**headers, "content-encoding": encoding, "vary": "Accept-Encoding",
+                             "etag": response.headers["etag"].rstrip('"') + f'-{encoding}"'},
+                )
+        return response
+
+    def _range_applies(self, response: Response, request_headers: Headers) -> bool:
+        """If-Range: only honour the range when the client's copy is still current"""
+        if_range = request_headers.get("if-range")
+        return if_range is None or if_range in (response.headers["etag"], response.headers["last-modified"])
+
+    def _sidecar(self, full_path: str, request_headers: Headers):
+        encoding = negotiate(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            return None
+        path = full_path + SIDECARS[encoding]
+        try:
+            return encoding, path, os.stat(path)
+        except OSError:
+            return None
+
+    def _offloaded(self, full_path: str, response: FileResponse) -> Response:
+        """Empty response telling the front proxy which file to send (it handles ranges too)"""
+        headers = {
+            key: response.headers[key]
+            for key in ("cache-control", "etag", "last-modified", "accept-ranges")
+        }
+        if self.offload == "x-sendfile":
+            headers["x-sendfile"] = os.path.abspath(full_path)
+        else:
+            relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+            headers["x-accel-redirect"] = self.offload_prefix.rstrip("/") + "/" + relative
+        return Response(status_code=200, headers=headers, media_type=response.media_type)
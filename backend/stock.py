@@ -0,0 +1,63 @@
+"""Stock reservation and restitution for purchase requests.
+
+A purchase request holds stock either for its single product or, for cart
+requests, for every line in ``items``. Every stock change stamps the product
+with a new catalog version.
+"""
+import asyncio
+from typing import Dict, List
+
+from pymongo import UpdateOne
+
+from catalog_versions import next_stamps, stamped
+
+def purchase_lines(purchase: dict) -> List[dict]:
+    return purchase.get("items") or [purchase]
+
+def merge_quantities(lines: List[dict]) -> Dict[str, int]:
+    """Total quantity per product across ``lines``"""
+    quantities: Dict[str, int] = {}
+    for line in lines:
+        quantities[line["product_id"]] = quantities.get(line["product_id"], 0) + line["quantity"]
+    return quantities
+
+async def _give_back(repo, quantities: Dict[str, int]):
+    """Add ``quantities`` back to stock with one bulk write (one update per product)"""
+    if not quantities:
+        return
+    stamps = await next_stamps(repo, len(quantities))
+    await repo.products.bulk_write(
+        [
+            UpdateOne({"id": product_id}, stamped({"$inc": {"stock": quantity}}, stamp))
+            for (product_id, quantity), stamp in zip(quantities.items(), stamps)
+        ],
+        ordered=False
+    )
+
+async def reserve(repo, lines: List[dict]) -> List[str]:
+    """Take stock for every line or for none.
+
+    Each product is decremented only if it still has enough stock; when any
+    line fails, the lines already taken are given back. Returns the ids of the
+    products without enough stock (empty on success).
+    """
+    quantities = merge_quantities(lines)
+    product_ids = list(quantities)
+    stamps = await next_stamps(repo, len(product_ids))
+    results = await asyncio.gather(*[
+        repo.products.update_one(
+            {"id": product_id, "stock": {"$gte": quantities[product_id]}},
+            stamped({"$inc": {"stock": -quantities[product_id]}}, stamp)
+        )
+        for product_id, stamp in zip(product_ids, stamps)
+    ])
+
+    failed = [product_id for product_id, result in zip(product_ids, results) if result.modified_count == 0]
+    if failed:
+        taken = [product_id for product_id, result in zip(product_ids, results) if result.modified_count == 1]
+        await _give_back(repo, {product_id: quantities[product_id] for product_id in taken})
+    return failed
+
+async def release(repo, purchases: List[dict]):
+    """Give back the stock held by ``purchases``"""
+    await _give_back(repo, merge_quantities([line for purchase in purchases for line in purchase_lines(purchase)]))
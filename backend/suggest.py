@@ -0,0 +1,149 @@
+"""In-memory prefix index for typeahead suggestions.
+
+Visible product names are normalized (accents removed, case-folded) and every
+word start is stored in one sorted list of ``(key, product_id)``, so "plat"
+finds "Collar de Plata". A lookup is a ``bisect`` to the first key with the
+prefix followed by a short forward scan. Categories are matched the same way
+from a small separate list.
+
+The index follows the catalog through its change versions: ``load`` builds it
+once, ``sync`` applies only products changed since the last version it saw
+(after admin writes in this worker, and periodically for writes made
+elsewhere). Memory is bounded by the catalog size times ``MAX_WORDS``.
+"""
+import asyncio
+import os
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+import catalog_versions
+from repository import VISIBLE_PRODUCTS
+
+MAX_WORDS = 12
+MAX_PREFIX_LENGTH = 64
+FIELDS = ("id", "name", "category", "price", "image_url", "images")
+
+def sync_seconds() -> int:
+    return int(os.environ.get('SUGGEST_SYNC_SECONDS', '10'))
+
+def normalize(text: str) -> str:
+    """'  Collar de PLATA ñandú ' -> 'collar de plata nandu'"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w]+", " ", stripped.casefold()).split())
+
+def word_starts(text: str) -> List[str]:
+    """Keys for every word start: 'collar de plata', 'de plata', 'plata'"""
+    words = normalize(text).split()[:MAX_WORDS]
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+class SuggestIndex:
+    def __init__(self):
+        self._keys: List[Tuple[str, str]] = []
+        self._products: Dict[str, dict] = {}
+        self._categories: Dict[str, List] = {}  # normalized -> [display name, product count]
+        self._category_keys: List[str] = []
+        self._lock = asyncio.Lock()
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    # ---------- maintenance ----------
+
+    def upsert(self, product: dict):
+        self.remove(product["id"])
+        if not product.get("is_visible", True):
+            return
+        entry = {field: product.get(field) for field in FIELDS if field != "images"}
+        if not entry["image_url"]:
+            # Thumbnail: the first picture (or video poster) in the gallery
+            for image in product.get("images") or []:
+                entry["image_url"] = image.get("poster_url") if image.get("type") == "video" else image.get("url")
+                if entry["image_url"]:
+                    break
+        self._products[entry["id"]] = entry
+        for key in word_starts(entry["name"]):
+            insort(self._keys, (key, entry["id"]))
+        self._count_category(entry.get("category"), 1)
+
+    def remove(self, product_id: str):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return
+        for key in word_starts(entry["name"]):
+            position = bisect_left(self._keys, (key, product_id))
+            if position < len(self._keys) and self._keys[position] == (key, product_id):
+                del self._keys[position]
+        self._count_category(entry.get("category"), -1)
+
+    def _count_category(self, category: str, delta: int):
+        key = normalize(category or "")
+        if not key:
+            return
+        if key not in self._categories:
+            self._categories[key] = [category, 0]
+            insort(self._category_keys, key)
+        self._categories[key][1] += delta
+        if self._categories[key][1] <= 0:
+            del self._categories[key]
+            del self._category_keys[bisect_left(self._category_keys, key)]
+
+    async def load(self, repo):
+        """Full build from the visible catalog"""
+        async with self._lock:
+            # Version first: anything written meanwhile is applied again by the next sync
+            version = await catalog_versions.current_version(repo)
+            products = await repo.find(repo.catalog, VISIBLE_PRODUCTS, {"_id": 0, **{f: 1 for f in FIELDS}}, limit=None)
+            self._keys, self._products, self._categories, self._category_keys = [], {}, {}, []
+            for product in products:
+                self.upsert({**product, "is_visible": True})
+            self.version = version
+
+    async def sync(self, repo) -> int:
+        """Apply catalog changes since the last sync; returns how many were applied"""
+        async with self._lock:
+            applied = 0
+            while True:
+                changes = await catalog_versions.changes_since(repo, self.version, include_hidden=False)
+                for product in changes["upserted"]:
+                    self.upsert(product)
+                for product_id in changes["deleted"]:
+                    self.remove(product_id)
+                applied += len(changes["upserted"]) + len(changes["deleted"])
+                self.version = changes["version"]
+                if not changes["has_more"]:
+                    return applied
+
+    # ---------- lookup ----------
+
+    def suggest(self, prefix: str, limit: int = 8) -> dict:
+        query = normalize(prefix[:MAX_PREFIX_LENGTH])
+        if not query:
+            return {"products": [], "categories": []}
+
+        products = []
+        seen = set()
+        position = bisect_left(self._keys, (query, ""))
+        while position < len(self._keys) and len(products) < limit:
+            key, product_id = self._keys[position]
+            if not key.startswith(query):
+                break
+            if product_id not in seen:
+                seen.add(product_id)
+                products.append(self._products[product_id])
+            position += 1
+
+        categories = []
+        position = bisect_left(self._category_keys, query)
+        while position < len(self._category_keys) and len(categories) < limit:
+            key = self._category_keys[position]
+            if not key.startswith(query):
+                break
+            name, count = self._categories[key]
+            categories.append({"category": name, "count": count})
+            position += 1
+
+        return {"products": products, "categories": categories}
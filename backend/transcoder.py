@@ -0,0 +1,279 @@
+"""Background transcoding of product videos.
+
+Uploaded videos are served as-is, often multi-megabyte phone recordings. For
+every product video without renditions a local ``ffmpeg`` produces a
+compressed MP4 (``+faststart``, so playback starts before the download ends),
+an HLS segment set (for Safari/iOS, which switch between segments on slow
+connections) and a poster frame. Their URLs are recorded on every
+``ProductImage`` with that source URL.
+
+Renditions are stored where the originals are (``UPLOAD_STORAGE``): with
+``local`` in ``uploads/renditions/<hash of the source URL>/``, served by the
+``/uploads`` mount with range support; with ``gcs`` under
+``renditions/<hash>/`` in the bucket, so every instance (and the next one after
+a restart) can serve them.
+
+At most ``TRANSCODE_WORKERS`` ffmpeg processes run at once. Outputs are built
+in a scratch directory next to (not inside) the served uploads directory, on
+the same filesystem, and published as a whole (renamed into place, or uploaded
+with the poster last), so partial output is never served, a published
+rendition set is always complete and a job for an already transcoded URL (a
+product saved again, another worker) finishes immediately. Scratch directories
+left by a killed process are removed on the next start.
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+from pymongo import UpdateOne
+
+import gcs
+import metrics
+import static_files
+from catalog_versions import next_stamps, stamped
+from logging_setup import log_event
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = "renditions"
+# Suffix of the scratch directory, a sibling of the uploads directory
+WORK_DIR_SUFFIX = "-transcoding"
+UNFINISHED = ["pending", "processing"]
+# Segments of about this many seconds; keyframes are forced at the same interval
+SEGMENT_SECONDS = 4
+
+def workers() -> int:
+    return max(1, int(os.environ.get('TRANSCODE_WORKERS', '2')))
+
+def timeout_seconds() -> float:
+    return float(os.environ.get('TRANSCODE_TIMEOUT_SECONDS', '900'))
+
+def ffmpeg_path() -> Optional[str]:
+    return os.environ.get('FFMPEG_PATH') or shutil.which("ffmpeg")
+
+class TranscodeError(Exception):
+    pass
+
+async def _ffmpeg(*args):
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg_path(), "-hide_banner", "-loglevel", "error", "-y", *[str(arg) for arg in args],
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Timeout or shutdown: don't leave ffmpeg running
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise TranscodeError(stderr.decode(errors="replace")[-500:])
+
+RENDITION_FILES = {"mp4_url": "video.mp4", "hls_url": "index.m3u8", "poster_url": "poster.jpg"}
+
+class LocalRenditions:
+    """Renditions under ``upload_dir/renditions``, served by the /uploads mount"""
+
+    def __init__(self, upload_dir: Path):
+        self.root = upload_dir / RENDITIONS_DIR
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def urls(self, key: str) -> dict:
+        return {field: f"/uploads/{RENDITIONS_DIR}/{key}/{name}" for field, name in RENDITION_FILES.items()}
+
+    async def exists(self, key: str) -> bool:
+        return (self.root / key).exists()
+
+    async def publish(self, key: str, work: Path):
+        try:
+            os.rename(work, self.root / key)
+        except OSError:
+            # Another worker finished the same video first
+            if not (self.root / key).exists():
+                raise
+
+class GcsRenditions:
+    """Renditions in the uploads bucket, next to the originals"""
+
+    def __init__(self):
+        self._bucket = None
+
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = gcs.bucket()
+        return self._bucket
+
+    def urls(self, key: str) -> dict:
+        return {
+            field: self.bucket().blob(f"{RENDITIONS_DIR}/{key}/{name}").public_url
+            for field, name in RENDITION_FILES.items()
+        }
+
+    async def exists(self, key: str) -> bool:
+        # The poster is uploaded last: once it exists, the whole set does
+        poster = self.bucket().blob(f"{RENDITIONS_DIR}/{key}/{RENDITION_FILES['poster_url']}")
+        return await asyncio.to_thread(poster.exists)
+
+    async def publish(self, key: str, work: Path):
+        poster = RENDITION_FILES["poster_url"]
+        for path in sorted(work.iterdir(), key=lambda path: path.name == poster):
+            blob = self.bucket().blob(f"{RENDITIONS_DIR}/{key}/{path.name}")
+            blob.cache_control = static_files.IMMUTABLE
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            await asyncio.to_thread(blob.upload_from_filename, str(path), content_type=content_type)
+            gcs.make_public(blob)
+
+def rendition_store(upload_dir: Path):
+    return LocalRenditions(upload_dir) if gcs.upload_storage() == "local" else GcsRenditions()
+
+class Transcoder:
+    def __init__(self, repo, upload_dir: Path, size: Optional[int] = None, store=None):
+        self.repo = repo
+        self.upload_dir = upload_dir
+        self.store = store or rendition_store(upload_dir)
+        # Scratch space is always local, outside the /uploads mount
+        self.work_root = upload_dir.with_name(upload_dir.name + WORK_DIR_SUFFIX)
+        self.work_root.mkdir(parents=True, exist_ok=True)
+        self._clear_stale_work(upload_dir)
+        self._slots = asyncio.Semaphore(size or workers())
+        self._jobs: Dict[str, asyncio.Task] = {}
+
+    def _clear_stale_work(self, upload_dir: Path):
+        """Remove scratch directories of jobs that outlived the timeout (their process died)"""
+        cutoff = time.time() - timeout_seconds()
+        legacy_root = upload_dir / RENDITIONS_DIR
+        # Scratch directories used to be ``.<key>-*`` inside the served renditions directory
+        legacy = [work for work in legacy_root.glob(".*") if work.is_dir()] if legacy_root.is_dir() else []
+        for work in [*self.work_root.iterdir(), *legacy]:
+            try:
+                if work.stat().st_mtime < cutoff:
+                    shutil.rmtree(work, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def available(self) -> bool:
+        return ffmpeg_path() is not None
+
+    def pending_videos(self, images: Optional[List[dict]]) -> List[str]:
+        """Flag videos without renditions as pending (in place); returns their URLs"""
+        if not images or not self.available:
+            return []
+        urls = []
+        for image in images:
+            if image.get("type") == "video" and not image.get("mp4_url"):
+                image["transcode_status"] = "pending"
+                urls.append(image["url"])
+        return urls
+
+    def enqueue(self, url: str) -> bool:
+        """Start a job for ``url`` unless one is already running in this worker"""
+        if not self.available or url in self._jobs:
+            return False
+        task = asyncio.get_running_loop().create_task(self._run(url))
+        self._jobs[url] = task
+        task.add_done_callback(lambda _: self._jobs.pop(url, None))
+        return True
+
+    async def resume_unfinished(self) -> int:
+        """Re-enqueue videos left pending or interrupted by a restart"""
+        products = await self.repo.products.find(
+            {"images": {"$elemMatch": {"type": "video", "transcode_status": {"$in": UNFINISHED}}}},
+            {"_id": 0, "images": 1}
+        ).to_list(None)
+        urls = {
+            image["url"]
+            for product in products
+            for image in product.get("images") or []
+            if image.get("type") == "video" and image.get("transcode_status") in UNFINISHED
+        }
+        return sum(self.enqueue(url) for url in urls)
+
+    async def drain(self, timeout: float):
+        """Wait for running jobs (shutdown); unfinished ones are resumed on the next start"""
+        if self._jobs:
+            await asyncio.wait(list(self._jobs.values()), timeout=timeout)
+
+    async def _run(self, url: str):
+        async with self._slots:
+            await self._record(url, {"transcode_status": "processing"})
+            started = time.perf_counter()
+            try:
+                renditions = await asyncio.wait_for(self._transcode(url), timeout_seconds())
+            except Exception as e:
+                metrics.inc("transcode_failed")
+                log_event(logger, "video_transcode_failed", logging.ERROR, url=url, error=str(e) or type(e).__name__)
+                await self._record(url, {"transcode_status": "failed"})
+                return
+            await self._record(url, {**renditions, "transcode_status": "ready"})
+            metrics.inc("transcode_ready")
+            log_event(logger, "video_transcoded", url=url, duration_ms=round((time.perf_counter() - started) * 1000, 2))
+
+    async def _transcode(self, url: str) -> dict:
+        key = hashlib.sha256(url.encode()).hexdigest()[:32]
+        if await self.store.exists(key):
+            return self.store.urls(key)
+
+        work = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=self.work_root))
+        try:
+            source = await self._source(url, work)
+            mp4 = work / "video.mp4"
+            await _ffmpeg(
+                "-i", source,
+                "-vf", "scale='min(1280,iw)':-2", "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+                "-pix_fmt", "yuv420p", "-force_key_frames", f"expr:gte(t,n_forced*{SEGMENT_SECONDS})",
+                "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart", mp4
+            )
+            # Segment the compressed MP4 without re-encoding
+            await _ffmpeg(
+                "-i", mp4, "-c", "copy", "-f", "hls", "-hls_time", SEGMENT_SECONDS, "-hls_playlist_type", "vod",
+                "-hls_segment_filename", work / "segment_%03d.ts", work / "index.m3u8"
+            )
+            await _ffmpeg("-i", mp4, "-vf", "thumbnail", "-frames:v", "1", "-q:v", "3", work / "poster.jpg")
+            (work / "source").unlink(missing_ok=True)
+            await self.store.publish(key, work)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        return self.store.urls(key)
+
+    async def _source(self, url: str, work: Path) -> Path:
+        """Path of the original: read in place when it is a local upload, downloaded otherwise"""
+        if "/uploads/" in url:
+            local = (self.upload_dir / url.split("/uploads/", 1)[1]).resolve()
+            if local.is_file() and self.upload_dir.resolve() in local.parents:
+                return local
+        if not url.startswith(("http://", "https://")):
+            raise TranscodeError(f"Video no encontrado: {url}")
+
+        path = work / "source"
+        async with httpx.AsyncClient(timeout=60, follow_redirects=True) as client:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                with open(path, "wb") as file:
+                    async for chunk in response.aiter_bytes(1024 * 1024):
+                        file.write(chunk)
+        return path
+
+    async def _record(self, url: str, fields: dict):
+        """Set ``fields`` on every product image with this source URL"""
+        products = await self.repo.products.find({"images.url": url}, {"_id": 0, "id": 1}).to_list(None)
+        if not products:
+            return
+        stamps = await next_stamps(self.repo, len(products))
+        update = {"$set": {f"images.$[video].{name}": value for name, value in fields.items()}}
+        await self.repo.products.bulk_write(
+            [
+                UpdateOne({"id": product["id"]}, stamped(update, stamp),
+                          array_filters=[{"video.url": url, "video.type": "video"}])
+                for product, stamp in zip(products, stamps)
+            ],
+            ordered=False
+        )
@@ -0,0 +1,110 @@
+"""Storage for phone verification codes.
+
+Codes expire after ``VERIFICATION_CODE_TTL_SECONDS`` and allow at most
+``VERIFICATION_MAX_ATTEMPTS`` wrong guesses. By default (``VERIFICATION_STORE=mongo``)
+they live in a TTL-indexed collection shared by all workers and instances, with
+one write per operation on the success path. ``VERIFICATION_STORE=memory`` keeps
+them in a per-worker map instead (no database I/O): only for a single-process
+development server, since a code sent by one worker cannot be checked by another.
+"""
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+
+OK = "ok"
+INVALID = "invalid"
+EXPIRED = "expired"
+LOCKED = "locked"
+
+def code_ttl_seconds() -> int:
+    return int(os.environ.get('VERIFICATION_CODE_TTL_SECONDS', '600'))
+
+def max_attempts() -> int:
+    return int(os.environ.get('VERIFICATION_MAX_ATTEMPTS', '5'))
+
+class MemoryCodeStore:
+    """Per-worker map phone -> (code, expiry, attempts), bounded to ``max_entries``"""
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._codes: OrderedDict = OrderedDict()
+
+    async def ensure_indexes(self):
+        pass
+
+    async def issue(self, phone: str, code: str):
+        self._codes.pop(phone, None)
+        self._codes[phone] = [code, time.monotonic() + code_ttl_seconds(), 0]
+        while len(self._codes) > self.max_entries:
+            self._codes.popitem(last=False)
+
+    async def check(self, phone: str, code: str) -> str:
+        entry = self._codes.get(phone)
+        if entry is None:
+            return INVALID
+        stored_code, expires_at, attempts = entry
+        if expires_at < time.monotonic():
+            del self._codes[phone]
+            return EXPIRED
+        if attempts >= max_attempts():
+            return LOCKED
+        if stored_code != code:
+            entry[2] += 1
+            return INVALID
+        del self._codes[phone]
+        return OK
+
+class MongoCodeStore:
+    """Codes in a collection whose documents are removed by a TTL index on ``expires_at``"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("phone", 1)], unique=True)
+        await self.collection.create_index([("expires_at", 1)], expireAfterSeconds=0)
+
+    async def issue(self, phone: str, code: str):
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"phone": phone},
+            {"$set": {
+                "code": code,
+                "attempts": 0,
+                "created_at": now.isoformat(),
+                "expires_at": now + timedelta(seconds=code_ttl_seconds()),
+            }},
+            upsert=True
+        )
+
+    async def check(self, phone: str, code: str) -> str:
+        now = datetime.now(timezone.utc)
+        matched = await self.collection.find_one_and_delete(
+            {"phone": phone, "code": code, "expires_at": {"$gt": now}, "attempts": {"$lt": max_attempts()}},
+            projection={"_id": 1}
+        )
+        if matched:
+            return OK
+
+        # Wrong code (or expired / locked): count the attempt
+        entry = await self.collection.find_one_and_update(
+            {"phone": phone},
+            {"$inc": {"attempts": 1}},
+            projection={"_id": 0, "expires_at": 1, "attempts": 1}
+        )
+        if not entry or "expires_at" not in entry:
+            return INVALID
+        expires_at = entry["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= now:
+            return EXPIRED
+        if entry["attempts"] >= max_attempts():
+            return LOCKED
+        return INVALID
+
+def create_code_store(collection):
+    if os.environ.get('VERIFICATION_STORE', 'mongo') == 'memory':
+        return MemoryCodeStore()
+    return MongoCodeStore(collection)
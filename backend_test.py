@@ -396,6 +396,57 @@ class EcommerceAPITester:
             self.log_result("GET /requests (admin)", False, 
                           error_msg=f"Status: {response.status_code if response else 'No response'}")
 
+    def test_concurrent_transitions(self, attempts=20):
+        """Hammer complete/reject on the same purchase request: exactly one must win"""
+        print("\n🏁 Testing Concurrent Request Transitions...")
+        
+        from concurrent.futures import ThreadPoolExecutor
+        
+        if not self.test_product_id:
+            print("⚠️ No test product available, skipping concurrency test")
+            return
+        
+        response = self.make_request('GET', f'products/{self.test_product_id}', use_admin=True)
+        if not response or response.status_code != 200 or response.json().get('stock', 0) < 1:
+            print("⚠️ Test product has no stock, skipping concurrency test")
+            return
+        stock_before = response.json()['stock']
+        
+        purchase_data = {
+            "user_email": "test@example.com",
+            "user_name": "Test User",
+            "user_phone": self.test_phone,
+            "product_id": self.test_product_id,
+            "quantity": 1
+        }
+        response = self.make_request('POST', 'requests/purchase', data=purchase_data)
+        if not response or response.status_code != 200:
+            self.log_result("Concurrent complete/reject", False,
+                          error_msg=f"Could not create purchase: {response.status_code if response else 'No response'}")
+            return
+        request_id = response.json()['id']
+        
+        actions = ['complete' if i % 2 == 0 else 'reject' for i in range(attempts)]
+        with ThreadPoolExecutor(max_workers=attempts) as pool:
+            responses = list(pool.map(
+                lambda action: self.make_request('PUT', f'requests/purchase/{request_id}/{action}', use_admin=True),
+                actions
+            ))
+        
+        statuses = [r.status_code if r is not None else None for r in responses]
+        winners = [action for action, status in zip(actions, statuses) if status == 200]
+        losers_ok = all(status == 400 for status in statuses if status != 200)
+        
+        response = self.make_request('GET', f'products/{self.test_product_id}', use_admin=True)
+        stock_after = response.json()['stock'] if response and response.status_code == 200 else None
+        # Stock comes back exactly once if reject won, never if complete won
+        expected_stock = stock_before if winners == ['reject'] else stock_before - 1
+        
+        success = len(winners) == 1 and losers_ok and stock_after == expected_stock
+        self.log_result("Concurrent complete/reject", success,
+                      f"Winner: {winners}, stock {stock_before} -> {stock_after}",
+                      error_msg=f"Statuses: {statuses}, stock {stock_before} -> {stock_after} (expected {expected_stock})")
+
     def test_image_transformations(self):
         """Test image transformation functionality specifically"""
         print("\n🖼️ Testing Image Transformation Features...")
@@ -558,6 +609,7 @@ class EcommerceAPITester:
         self.test_product_endpoints()
         self.test_image_transformations()
         self.test_request_endpoints()
+        self.test_concurrent_transitions()
         self.test_config_endpoints()
         self.test_unauthorized_access()
         
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Cart checkout vs. one purchase request per item.
+
+Buys the same basket (one unit of each of the first N in-stock products) through
+N calls to POST /api/requests/purchase and through one call to
+POST /api/requests/purchase/cart, and reports wall time and HTTP calls.
+
+This creates real purchase requests and takes real stock: run it only against a
+development backend with RATE_LIMIT_ENABLED=false, then reject the created
+requests from the admin dashboard to give the stock back.
+
+Usage: python benchmarks/cart_checkout.py [base_url] [items] [rounds]
+"""
+
+import statistics
+import sys
+import time
+
+import requests
+
+CUSTOMER = {
+    "user_email": "benchmark@example.com",
+    "user_name": "Benchmark",
+    "user_phone": "+50400000000",
+}
+
+def basket(api_url, size, rounds):
+    products = requests.get(f"{api_url}/products").json()
+    # Enough stock for both paths in every round
+    in_stock = [p for p in products if p["stock"] >= 2 * rounds]
+    if len(in_stock) < size:
+        sys.exit(f"Need {size} products with at least {2 * rounds} units in stock, found {len(in_stock)}")
+    return [p["id"] for p in in_stock[:size]]
+
+def per_item(session, api_url, product_ids):
+    for product_id in product_ids:
+        response = session.post(f"{api_url}/requests/purchase", json={**CUSTOMER, "product_id": product_id, "quantity": 1})
+        response.raise_for_status()
+    return len(product_ids)
+
+def cart(session, api_url, product_ids):
+    items = [{"product_id": product_id, "quantity": 1} for product_id in product_ids]
+    response = session.post(f"{api_url}/requests/purchase/cart", json={**CUSTOMER, "items": items})
+    response.raise_for_status()
+    return 1
+
+def timed(func, *args):
+    started = time.perf_counter()
+    calls = func(*args)
+    return time.perf_counter() - started, calls
+
+def main():
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8001"
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    api_url = f"{base_url}/api"
+
+    product_ids = basket(api_url, size, rounds)
+    session = requests.Session()
+
+    results = {"per-item": [], "cart": []}
+    calls = {}
+    for _ in range(rounds):
+        elapsed, calls["per-item"] = timed(per_item, session, api_url, product_ids)
+        results["per-item"].append(elapsed)
+        elapsed, calls["cart"] = timed(cart, session, api_url, product_ids)
+        results["cart"].append(elapsed)
+
+    print(f"Basket of {size} products, {rounds} rounds against {base_url}")
+    for name, samples in results.items():
+        print(f"  {name:<9} {calls[name]:>3} HTTP calls  "
+              f"median {statistics.median(samples) * 1000:8.1f} ms  max {max(samples) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
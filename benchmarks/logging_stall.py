@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Event-loop stall caused by request-notification logging.
+
+Compares the old setup (six synchronous logger.info calls per request through a
+StreamHandler on the event loop thread) with the queued pipeline from
+backend/logging_setup.py (one structured record per request, written by a
+listener thread). Output goes to a stream whose writes take WRITE_DELAY seconds,
+standing in for slow stdout or log shipping.
+
+Usage: python benchmarks/logging_stall.py [requests]
+"""
+
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import logging_setup  # noqa: E402
+
+WRITE_DELAY = 0.0005
+TICK = 0.001
+
+class SlowStream:
+    def write(self, data):
+        time.sleep(WRITE_DELAY)
+        return len(data)
+
+    def flush(self):
+        pass
+
+def old_style(logger, i):
+    logger.info(f"📧 MOCK EMAIL: Solicitud de compra #{i}")
+    logger.info("   Cliente: Anónimo Anónimo")
+    logger.info("   Producto: Producto de prueba")
+    logger.info("   Cantidad: 1")
+    logger.info("   Total: Lps 100.00")
+    logger.info("   Teléfono: +50499999999")
+
+def new_style(logger, i):
+    logging_setup.log_event(
+        logger, "purchase_request_created", request_id=str(i), customer="Anónimo Anónimo",
+        product_name="Producto de prueba", quantity=1, total_price=100.0, phone="+50499999999"
+    )
+
+async def measure(emit, requests):
+    """Max/percentile lateness of a 1 ms ticker while ``requests`` events are logged"""
+    logger = logging.getLogger("bench")
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    async def traffic():
+        for i in range(requests):
+            emit(logger, i)
+            await asyncio.sleep(0)
+        done.set()
+
+    started = time.perf_counter()
+    await asyncio.gather(ticker(), traffic())
+    elapsed = time.perf_counter() - started
+
+    lags.sort()
+    return {
+        "elapsed_s": elapsed,
+        "p50_ms": statistics.median(lags) * 1000,
+        "p99_ms": lags[int(len(lags) * 0.99) - 1] * 1000,
+        "max_ms": lags[-1] * 1000,
+    }
+
+def report(name, result):
+    print(f"{name:<22} total {result['elapsed_s']:.3f}s  "
+          f"stall p50 {result['p50_ms']:.2f}ms  p99 {result['p99_ms']:.2f}ms  max {result['max_ms']:.2f}ms")
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    root = logging.getLogger()
+    root.handlers = [logging.StreamHandler(SlowStream())]
+    root.setLevel(logging.INFO)
+    report("sync, 6 lines/request", asyncio.run(measure(old_style, requests)))
+
+    logging_setup.configure_logging(stream=SlowStream())
+    report("queued, 1 JSON record", asyncio.run(measure(new_style, requests)))
+    logging_setup.shutdown_logging()
+
+if __name__ == "__main__":
+    main()
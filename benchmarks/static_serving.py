@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Upload serving throughput: through the app vs. offloaded to the front proxy.
+
+Downloads the same file repeatedly from two URLs and reports requests/s, MB/s
+and latency percentiles for each. Typical setup: the first URL points straight
+at uvicorn (UploadFiles streams the file from Python), the second at nginx in
+front of a worker started with UPLOADS_OFFLOAD=x-accel-redirect, e.g.
+
+    location /uploads/ { proxy_pass http://127.0.0.1:8001; }
+    location /protected-uploads/ { internal; alias /app/backend/uploads/; }
+
+Pass a Range header to measure video seeking instead of full downloads.
+
+Usage: python benchmarks/static_serving.py app_url [offloaded_url] [requests] [concurrency] [range]
+  e.g. python benchmarks/static_serving.py http://localhost:8001/uploads/<file> http://localhost/uploads/<file> 500 16
+"""
+
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+def fetch(session, url, headers):
+    started = time.perf_counter()
+    response = session.get(url, headers=headers)
+    response.raise_for_status()
+    return time.perf_counter() - started, len(response.content)
+
+def run(url, total, concurrency, headers):
+    sessions = [requests.Session() for _ in range(concurrency)]
+    fetch(sessions[0], url, headers)  # warm-up (and fail fast on a bad URL)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda n: fetch(sessions[n % concurrency], url, headers), range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    transferred = sum(size for _, size in results)
+    return {
+        "rps": total / elapsed,
+        "mbps": transferred / elapsed / 1e6,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    urls = {"app": sys.argv[1]}
+    if len(sys.argv) > 2 and sys.argv[2]:
+        urls["offloaded"] = sys.argv[2]
+    total = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+    headers = {"Range": sys.argv[5]} if len(sys.argv) > 5 else {}
+
+    print(f"{total} requests, concurrency {concurrency}" + (f", Range: {headers['Range']}" if headers else ""))
+    for name, url in urls.items():
+        result = run(url, total, concurrency, headers)
+        print(f"  {name:<10} {result['rps']:8.1f} req/s  {result['mbps']:8.1f} MB/s  "
+              f"p50 {result['p50']:7.1f} ms  p99 {result['p99']:7.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -143,13 +143,12 @@ const AdminDashboard = ({ user, logout, darkMode, toggleDarkMode }) => {
         const newIndex = items.findIndex((item) => item.id === over.id);
         const newItems = arrayMove(items, oldIndex, newIndex);
 
-        // Save new order
-        const orderData = newItems.map((p, index) => ({
-          id: p.id,
-          display_order: index
-        }));
+        // Save new order: only the dragged product is moved next to its new neighbor
+        const moveData = newIndex < oldIndex
+          ? { before_id: newItems[newIndex + 1].id }
+          : { after_id: newItems[newIndex - 1].id };
 
-        axiosInstance.put('/products/reorder', { items: orderData })
+        axiosInstance.put(`/products/${active.id}/move`, moveData)
           .then(() => toast.success('Orden actualizado'))
           .catch((error) => {
             console.error('Error al guardar el orden:', error.response?.data || error);
@@ -789,6 +788,9 @@ const AdminDashboard = ({ user, logout, darkMode, toggleDarkMode }) => {
                               <div><span className="font-semibold">Teléfono:</span> {req.phone}</div>
                               <div><span className="font-semibold">Cantidad:</span> {req.quantity}</div>
                               <div><span className="font-semibold">Verificado:</span> {req.verified ? '✅ Sí' : '❌ No'}</div>
+                              {req.status === 'notified' && (
+                                <div><span className="font-semibold">Avisado:</span> {new Date(req.notified_at).toLocaleString('es-MX')}</div>
+                              )}
                             </div>
                             <Button
                               onClick={() => handleCompleteOutOfStockRequest(req.id)}
@@ -21,11 +21,23 @@ const ProductDetail = ({ user, logout, darkMode, toggleDarkMode }) => {
   const [showSuccessModal, setShowSuccessModal] = useState(false);
   const [successMessage, setSuccessMessage] = useState('');
   const [isModalOpen, setIsModalOpen] = useState(false);
+  const [relatedProducts, setRelatedProducts] = useState([]);
 
   useEffect(() => {
     fetchProduct();
+    fetchRelatedProducts();
   }, [id]);
 
+  const fetchRelatedProducts = async () => {
+    try {
+      const response = await axiosInstance.get(`/products/${id}/related`);
+      setRelatedProducts(response.data);
+    } catch (error) {
+      // Recommendations are optional: the page works without them
+      setRelatedProducts([]);
+    }
+  };
+
   const fetchProduct = async () => {
     try {
       const response = await axiosInstance.get(`/products/${id}`);
@@ -173,9 +185,12 @@ const ProductDetail = ({ user, logout, darkMode, toggleDarkMode }) => {
                 <div className="relative w-full h-full flex items-center justify-center bg-black">
                   {currentImage.type === 'video' ? (
                     <video
-                      src={getFullUrl(currentImage.url)}
+                      key={currentImage.url}
+                      poster={currentImage.poster_url ? getFullUrl(currentImage.poster_url) : undefined}
                       controls
                       autoPlay
+                      playsInline
+                      preload="metadata"
                       className="max-w-full max-h-full cursor-pointer"
                       style={{
                         transform: `scale(${currentImage.transform?.scale || 1})`,
@@ -185,7 +200,14 @@ const ProductDetail = ({ user, logout, darkMode, toggleDarkMode }) => {
                         e.preventDefault();
                         setIsModalOpen(true);
                       }}
-                    />
+                    >
+                      {/* HLS where supported natively (Safari/iOS), compressed MP4 elsewhere, original as fallback */}
+                      {currentImage.hls_url && (
+                        <source src={getFullUrl(currentImage.hls_url)} type="application/vnd.apple.mpegurl" />
+                      )}
+                      {currentImage.mp4_url && <source src={getFullUrl(currentImage.mp4_url)} type="video/mp4" />}
+                      <source src={getFullUrl(currentImage.url)} />
+                    </video>
                   ) : (
                     <img
                       src={getFullUrl(currentImage.url)}
@@ -225,8 +247,15 @@ const ProductDetail = ({ user, logout, darkMode, toggleDarkMode }) => {
                       }`}
                   >
                     {img.type === 'video' ? (
-                      <div className="w-full h-full flex items-center justify-center bg-gray-900">
-                        <Video className="w-8 h-8 text-white" />
+                      <div className="relative w-full h-full flex items-center justify-center bg-gray-900">
+                        {img.poster_url && (
+                          <img
+                            src={getFullUrl(img.poster_url)}
+                            alt={`Vista ${index + 1}`}
+                            className="absolute inset-0 w-full h-full object-cover opacity-80"
+                          />
+                        )}
+                        <Video className="relative w-8 h-8 text-white" />
                       </div>
                     ) : (
                       <img
@@ -385,6 +414,39 @@ const ProductDetail = ({ user, logout, darkMode, toggleDarkMode }) => {
 
           </div>
         </div>
+
+        {relatedProducts.length > 0 && (
+          <div className="mt-16" data-testid="related-products">
+            <h2 className="text-2xl font-bold text-gray-800 dark:text-white mb-6">Los clientes también pidieron</h2>
+            <div className="grid grid-cols-2 md:grid-cols-4 gap-6">
+              {relatedProducts.map((related) => {
+                const thumbnail = related.image_url || related.images?.find((image) => image.type !== 'video')?.url;
+                return (
+                  <div
+                    key={related.id}
+                    className="bg-white dark:bg-gray-800 rounded-2xl shadow-lg hover:shadow-xl transition-all overflow-hidden border border-gray-100 dark:border-gray-700 cursor-pointer"
+                    onClick={() => navigate(`/products/${related.id}`)}
+                    data-testid={`related-product-${related.id}`}
+                  >
+                    <div className="aspect-square bg-gradient-to-br from-sky-100 to-emerald-100 dark:from-gray-700 dark:to-gray-600">
+                      {thumbnail ? (
+                        <img src={getFullUrl(thumbnail)} alt={related.name} className="w-full h-full object-cover" loading="lazy" />
+                      ) : (
+                        <div className="w-full h-full flex items-center justify-center">
+                          <Package className="w-12 h-12 text-sky-300 dark:text-sky-600" />
+                        </div>
+                      )}
+                    </div>
+                    <div className="p-4">
+                      <h3 className="font-semibold text-gray-800 dark:text-white line-clamp-1">{related.name}</h3>
+                      <span className="text-sky-600 dark:text-sky-400 font-bold">Lps {related.price.toFixed(2)}</span>
+                    </div>
+                  </div>
+                );
+              })}
+            </div>
+          </div>
+        )}
       </div>
 
       <SuccessModal
@@ -397,7 +459,7 @@ const ProductDetail = ({ user, logout, darkMode, toggleDarkMode }) => {
         <ImageModal
           isOpen={isModalOpen}
           onClose={() => setIsModalOpen(false)}
-          imageUrl={getFullUrl(currentImage.url)}
+          imageUrl={getFullUrl(currentImage.type === 'video' ? currentImage.mp4_url || currentImage.url : currentImage.url)}
           alt={currentImage.description || product.name}
           onNext={handleNextImage}
           onPrev={handlePrevImage}
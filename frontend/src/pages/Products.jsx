@@ -14,10 +14,13 @@ const Products = ({ user, logout, darkMode, toggleDarkMode }) => {
   const [filteredProducts, setFilteredProducts] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
+  const [suggestions, setSuggestions] = useState({ products: [], categories: [] });
+  const [showSuggestions, setShowSuggestions] = useState(false);
+  const [sortPopular, setSortPopular] = useState(false);
 
   useEffect(() => {
     fetchProducts();
-  }, []);
+  }, [sortPopular]);
 
   useEffect(() => {
     if (searchTerm) {
@@ -32,9 +35,30 @@ const Products = ({ user, logout, darkMode, toggleDarkMode }) => {
     }
   }, [searchTerm, products]);
 
+  // Typeahead from the server's prefix index, once typing pauses
+  useEffect(() => {
+    if (!searchTerm.trim()) {
+      setSuggestions({ products: [], categories: [] });
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axiosInstance.get('/products/suggest', { params: { prefix: searchTerm } });
+        if (!cancelled) setSuggestions(response.data);
+      } catch (error) {
+        // Suggestions are optional: the grid below is still filtered
+      }
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchTerm]);
+
   const fetchProducts = async () => {
     try {
-      const response = await axiosInstance.get('/products');
+      const response = await axiosInstance.get('/products', { params: sortPopular ? { sort: 'popular' } : {} });
       setProducts(response.data);
       setFilteredProducts(response.data);
     } catch (error) {
@@ -54,16 +78,57 @@ const Products = ({ user, logout, darkMode, toggleDarkMode }) => {
           <h1 className="text-4xl sm:text-5xl font-bold bg-gradient-to-r from-sky-600 to-emerald-600 dark:from-sky-400 dark:to-emerald-400 bg-clip-text text-transparent mb-4" data-testid="products-title">
             Nuestros Productos
           </h1>
-          <div className="relative max-w-md">
-            <Search className="absolute left-3 top-1/2 transform -translate-y-1/2 text-gray-400 dark:text-gray-500 w-5 h-5" />
-            <Input
-              type="text"
-              placeholder="Buscar productos..."
-              value={searchTerm}
-              onChange={(e) => setSearchTerm(e.target.value)}
-              className="pl-10 py-6 text-base rounded-full border-2 border-gray-200 dark:border-gray-700 focus:border-sky-500 dark:focus:border-sky-400"
-              data-testid="search-input"
-            />
+          <div className="flex flex-wrap items-center gap-4">
+            <div className="relative max-w-md flex-1">
+              <Search className="absolute left-3 top-1/2 transform -translate-y-1/2 text-gray-400 dark:text-gray-500 w-5 h-5" />
+              <Input
+                type="text"
+                placeholder="Buscar productos..."
+                value={searchTerm}
+                onChange={(e) => {
+                  setSearchTerm(e.target.value);
+                  setShowSuggestions(true);
+                }}
+                onFocus={() => setShowSuggestions(true)}
+                onBlur={() => setTimeout(() => setShowSuggestions(false), 150)}
+                className="pl-10 py-6 text-base rounded-full border-2 border-gray-200 dark:border-gray-700 focus:border-sky-500 dark:focus:border-sky-400"
+                data-testid="search-input"
+              />
+              {showSuggestions && (suggestions.products.length > 0 || suggestions.categories.length > 0) && (
+                <div className="absolute z-20 mt-2 w-full bg-white dark:bg-gray-800 rounded-2xl shadow-lg border border-gray-100 dark:border-gray-700 overflow-hidden" data-testid="search-suggestions">
+                  {suggestions.categories.map((category) => (
+                    <button
+                      key={`category-${category.category}`}
+                      type="button"
+                      className="w-full text-left px-4 py-2 hover:bg-sky-50 dark:hover:bg-gray-700 text-sm text-sky-700 dark:text-sky-300"
+                      onMouseDown={() => setSearchTerm(category.category)}
+                    >
+                      {category.category} <span className="text-gray-400">({category.count})</span>
+                    </button>
+                  ))}
+                  {suggestions.products.map((product) => (
+                    <button
+                      key={product.id}
+                      type="button"
+                      className="w-full text-left px-4 py-2 hover:bg-sky-50 dark:hover:bg-gray-700 flex justify-between text-gray-800 dark:text-white"
+                      onMouseDown={() => navigate(`/products/${product.id}`)}
+                      data-testid={`suggestion-${product.id}`}
+                    >
+                      <span>{product.name}</span>
+                      <span className="text-gray-500 dark:text-gray-400">Lps {product.price?.toFixed(2)}</span>
+                    </button>
+                  ))}
+                </div>
+              )}
+            </div>
+            <Button
+              variant={sortPopular ? 'default' : 'outline'}
+              className="rounded-full"
+              onClick={() => setSortPopular(!sortPopular)}
+              data-testid="sort-popular-button"
+            >
+              Más vendidos
+            </Button>
           </div>
         </div>
 
@@ -0,0 +1,129 @@
+"""Purchase requests (cart and single product) must never oversell or strand reserved stock.
+
+Runs the API against a throwaway database on a local mongod; skipped when no
+mongod answers at ``MONGO_TEST_URL`` (default ``mongodb://localhost:27017``).
+"""
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("httpx")
+from pymongo import MongoClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL", "mongodb://localhost:27017")
+
+def _mongod_available() -> bool:
+    client = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+pytestmark = pytest.mark.skipif(not _mongod_available(), reason=f"no mongod at {MONGO_TEST_URL}")
+
+CART_URL = "/api/requests/purchase/cart"
+PURCHASE_URL = "/api/requests/purchase"
+STOCK = 5
+
+@pytest.fixture(scope="module")
+def app_env():
+    name = f"cart_requests_{uuid.uuid4().hex[:8]}"
+    os.environ.update({"MONGO_URL": MONGO_TEST_URL, "DB_NAME": name, "RATE_LIMIT_ENABLED": "false"})
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+    import index
+    from fastapi.testclient import TestClient
+
+    db = MongoClient(MONGO_TEST_URL)[name]
+    with TestClient(index.app) as client:
+        yield {"index": index, "client": client, "db": db}
+    db.client.drop_database(name)
+    db.client.close()
+
+@pytest.fixture
+def env(app_env, monkeypatch):
+    db = app_env["db"]
+    db.products.delete_many({})
+    db.purchase_requests.delete_many({})
+    db.products.insert_many([
+        {"id": product_id, "name": f"Producto {product_id}", "description": "", "price": 10.0,
+         "stock": STOCK, "is_visible": True}
+        for product_id in ("p1", "p2")
+    ])
+    # No email is sent from tests
+    monkeypatch.setattr(app_env["index"], "send_email", lambda **kwargs: True)
+    return app_env
+
+def _stock(db) -> dict:
+    return {product["id"]: product["stock"] for product in db.products.find({}, {"_id": 0, "id": 1, "stock": 1})}
+
+def _cart(**overrides) -> dict:
+    body = {
+        "user_email": "cliente@example.com",
+        "user_name": "Cliente",
+        "user_phone": "+50412345678",
+        "items": [{"product_id": "p1", "quantity": 2}, {"product_id": "p2", "quantity": 1}],
+    }
+    body.update(overrides)
+    return {key: value for key, value in body.items() if value is not None}
+
+def test_cart_reserves_stock(env):
+    response = env["client"].post(CART_URL, json=_cart())
+    assert response.status_code == 200, response.text
+    assert _stock(env["db"]) == {"p1": STOCK - 2, "p2": STOCK - 1}
+
+def test_missing_customer_field_keeps_stock(env):
+    response = env["client"].post(CART_URL, json=_cart(user_email=None))
+    assert response.status_code == 422
+    assert _stock(env["db"]) == {"p1": STOCK, "p2": STOCK}
+    assert env["db"].purchase_requests.count_documents({}) == 0
+
+@pytest.mark.parametrize("quantity", ["dos", 0, -1])
+def test_invalid_quantity_is_rejected(env, quantity):
+    response = env["client"].post(CART_URL, json=_cart(items=[{"product_id": "p1", "quantity": quantity}]))
+    assert response.status_code == 422
+    assert _stock(env["db"]) == {"p1": STOCK, "p2": STOCK}
+
+def test_failure_after_reserving_releases_stock(env, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise RuntimeError("rollup unavailable")
+
+    monkeypatch.setattr(env["index"].analytics, "record_created", fail)
+    with pytest.raises(RuntimeError):
+        env["client"].post(CART_URL, json=_cart())
+    assert _stock(env["db"]) == {"p1": STOCK, "p2": STOCK}
+    assert env["db"].purchase_requests.count_documents({}) == 0
+
+def _purchase(**overrides) -> dict:
+    body = {**_cart(), "product_id": "p1", "quantity": 2, **overrides}
+    body.pop("items")
+    return body
+
+def test_purchase_reserves_stock(env):
+    response = env["client"].post(PURCHASE_URL, json=_purchase())
+    assert response.status_code == 200, response.text
+    assert _stock(env["db"]) == {"p1": STOCK - 2, "p2": STOCK}
+
+@pytest.mark.parametrize("quantity", [STOCK + 1, 0, -1])
+def test_purchase_without_stock_or_bad_quantity_keeps_stock(env, quantity):
+    response = env["client"].post(PURCHASE_URL, json=_purchase(quantity=quantity))
+    assert response.status_code in (400, 422)
+    assert _stock(env["db"]) == {"p1": STOCK, "p2": STOCK}
+    assert env["db"].purchase_requests.count_documents({}) == 0
+
+def test_purchase_failure_after_reserving_releases_stock(env, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise RuntimeError("rollup unavailable")
+
+    monkeypatch.setattr(env["index"].analytics, "record_created", fail)
+    with pytest.raises(RuntimeError):
+        env["client"].post(PURCHASE_URL, json=_purchase())
+    assert _stock(env["db"]) == {"p1": STOCK, "p2": STOCK}
+    assert env["db"].purchase_requests.count_documents({}) == 0
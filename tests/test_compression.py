@@ -0,0 +1,81 @@
+"""Response compression negotiates brotli when the client accepts it."""
+import asyncio
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+brotli = pytest.importorskip("brotli")
+pytest.importorskip("httpx")
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import JSONResponse, PlainTextResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import compression  # noqa: E402
+
+BODY = {"products": [{"id": f"p{n}", "name": f"Producto {n}", "price": 10.0 + n} for n in range(200)]}
+
+def catalog(request):
+    return JSONResponse(BODY)
+
+def varied(request):
+    # Like the legacy upload responses, which already vary on Accept-Encoding
+    return JSONResponse(BODY, headers={"Vary": "Accept-Encoding"})
+
+def tiny(request):
+    return PlainTextResponse("ok")
+
+@pytest.fixture(scope="module")
+def client():
+    app = Starlette(routes=[Route("/catalog", catalog), Route("/varied", varied), Route("/tiny", tiny)])
+    app.add_middleware(compression.CompressionMiddleware)
+    return TestClient(app)
+
+def _raw(client, path, accept_encoding):
+    """Response without httpx's transparent decoding"""
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+def test_brotli_when_accepted(client):
+    response, raw = _raw(client, "/catalog", "gzip, deflate, br")
+    assert response.headers["content-encoding"] == "br"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert compression.negotiate("br") == "br"
+    assert brotli.decompress(raw) == client.get("/catalog", headers={"Accept-Encoding": "identity"}).content
+
+def test_gzip_when_brotli_not_accepted(client):
+    response, _ = _raw(client, "/catalog", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+
+def test_small_and_unaccepted_responses_untouched(client):
+    assert "content-encoding" not in client.get("/tiny", headers={"Accept-Encoding": "br"}).headers
+    assert "content-encoding" not in client.get("/catalog", headers={"Accept-Encoding": "identity"}).headers
+
+def test_vary_sent_once(client):
+    response, _ = _raw(client, "/varied", "br")
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers.get_list("vary") == ["Accept-Encoding"]
+
+def test_failed_precompression_is_retried(monkeypatch):
+    body = compression.PrecompressedBody(json.dumps(BODY).encode())
+    request = SimpleNamespace(headers={"accept-encoding": "br"})
+    compress = compression.compress
+
+    def fail(*args):
+        raise MemoryError("no memory for the window")
+
+    async def twice():
+        monkeypatch.setattr(compression, "compress", fail)
+        first = await body.response(request)
+        monkeypatch.setattr(compression, "compress", compress)
+        return first, await body.response(request)
+
+    first, second = asyncio.run(twice())
+    assert "content-encoding" not in first.headers and first.body == body.body
+    assert second.headers["content-encoding"] == "br"
+    assert brotli.decompress(second.body) == body.body
@@ -0,0 +1,309 @@
+"""Query-plan regression tests for the backend's hot queries.
+
+Each case runs real repository / job code against a throwaway database on a
+local mongod, records the commands it sends with a command listener, then
+explains every recorded command. A case fails when a winning plan scans the
+collection, sorts in memory, or (for reads) examines more documents than
+``max_ratio`` times the documents it returns.
+
+Skipped when no mongod answers at ``MONGO_TEST_URL`` (default
+``mongodb://localhost:27017``).
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("motor")
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo import MongoClient, monitoring  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import analytics  # noqa: E402
+import archiver  # noqa: E402
+import catalog_versions  # noqa: E402
+import popularity  # noqa: E402
+import ranking  # noqa: E402
+import reaper  # noqa: E402
+import stock  # noqa: E402
+from back_in_stock import BackInStockNotifier  # noqa: E402
+from repository import Repository, PRODUCT_STOCK_PROJECTION, VISIBLE_PRODUCTS  # noqa: E402
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL", "mongodb://localhost:27017")
+
+def _mongod_available() -> bool:
+    client = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+pytestmark = pytest.mark.skipif(not _mongod_available(), reason=f"no mongod at {MONGO_TEST_URL}")
+
+READS = {"find", "aggregate", "count", "distinct"}
+WRITES = {"findAndModify", "update", "delete"}
+# Session / routing fields the driver adds; explain rejects or ignores them
+DRIVER_FIELDS = {
+    "$db", "lsid", "$clusterTime", "$readPreference", "txnNumber", "writeConcern", "readConcern", "maxTimeMS",
+}
+
+CATEGORIES = ["anillos", "collares", "pulseras", "aretes", "relojes"]
+PRODUCT_COUNT = 300
+REQUEST_COUNT = 400
+
+# ==================== RECORDING / EXPLAIN ====================
+
+class CommandRecorder(monitoring.CommandListener):
+    """Keeps the explainable commands sent while ``commands`` is a list"""
+
+    def __init__(self):
+        self.commands = None
+
+    def started(self, event):
+        if self.commands is not None and event.command_name in READS | WRITES:
+            command = {k: v for k, v in event.command.items() if k not in DRIVER_FIELDS}
+            self.commands.append((event.command_name, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def _values(node, key):
+    """Every value stored under ``key`` anywhere in an explain document"""
+    if isinstance(node, dict):
+        for k, value in node.items():
+            if k == key:
+                yield value
+            yield from _values(value, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _values(item, key)
+
+def _statements(name: str, command: dict):
+    """Explain takes one write statement at a time; split bulk writes"""
+    if name == "update" and len(command["updates"]) > 1:
+        for statement in command["updates"]:
+            yield {**command, "updates": [statement]}
+    elif name == "delete" and len(command["deletes"]) > 1:
+        for statement in command["deletes"]:
+            yield {**command, "deletes": [statement]}
+    else:
+        yield command
+
+def _sorts_documents(node) -> bool:
+    """A blocking SORT over documents (sorting $group output is fine)"""
+    if isinstance(node, dict):
+        if node.get("stage") == "SORT" and "GROUP" not in set(_values(node, "stage")) - {"SORT"}:
+            return True
+        return any(_sorts_documents(value) for value in node.values())
+    if isinstance(node, list):
+        return any(_sorts_documents(item) for item in node)
+    return False
+
+def _pipeline_sorts_documents(explain: dict) -> bool:
+    for stage in explain.get("stages", []):
+        if "$group" in stage:
+            return False
+        if "$sort" in stage:
+            return True
+    return False
+
+def plan_problems(explain: dict, name: str, max_ratio) -> list:
+    problems = []
+    plans = list(_values(explain, "winningPlan"))
+    if "COLLSCAN" in {stage for plan in plans for stage in _values(plan, "stage")}:
+        problems.append("COLLSCAN")
+    if _sorts_documents(plans) or _pipeline_sorts_documents(explain):
+        problems.append("in-memory SORT")
+
+    if name in READS and max_ratio is not None:
+        stats = next((s for s in _values(explain, "executionStats") if "totalDocsExamined" in s), None)
+        if stats:
+            examined, returned = stats["totalDocsExamined"], stats["nReturned"]
+            if examined > max_ratio * max(returned, 1):
+                problems.append(f"examined {examined} docs for {returned} results")
+    return problems
+
+# ==================== FIXTURES ====================
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture(scope="module")
+def env(loop):
+    recorder = CommandRecorder()
+    name = f"query_plans_{uuid.uuid4().hex[:8]}"
+    sync_client = MongoClient(MONGO_TEST_URL)
+
+    async def setup():
+        client = AsyncIOMotorClient(MONGO_TEST_URL, event_listeners=[recorder])
+        repo = Repository(client[name])
+        await repo.ensure_indexes()
+        return client, repo
+
+    client, repo = loop.run_until_complete(setup())
+    seed(sync_client[name])
+    yield {"repo": repo, "recorder": recorder, "db": sync_client[name]}
+
+    sync_client.drop_database(name)
+    sync_client.close()
+    client.close()
+
+def _iso(days_ago: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+
+def seed(db):
+    """A catalog and request history shaped like production, large enough for the planner to matter"""
+    ranks = ranking.spaced_ranks(PRODUCT_COUNT)
+    products = []
+    for n in range(PRODUCT_COUNT):
+        product = {
+            "id": f"p{n}",
+            "name": f"Producto {n}",
+            "category": CATEGORIES[n % len(CATEGORIES)],
+            "price": 10.0 + n,
+            "stock": 50,
+            "rank": ranks[n],
+            "version": n + 1,
+            "changed_at": _iso(1),
+            "created_at": _iso(30),
+        }
+        # Mostly visible, some hidden, some from before the visibility flag existed
+        if n % 10 == 0:
+            product["is_visible"] = False
+        elif n % 10 != 1:
+            product["is_visible"] = True
+        products.append(product)
+    db.products.insert_many(products)
+    db.product_tombstones.insert_many(
+        [{"id": f"gone{n}", "version": PRODUCT_COUNT + n + 1, "changed_at": _iso(1)} for n in range(20)]
+    )
+    db.counters.insert_one({"_id": catalog_versions.COUNTER_ID, "seq": PRODUCT_COUNT + 20})
+
+    db.users.insert_many([{"id": f"u{n}", "email": f"user{n}@example.com", "role": "user"} for n in range(100)])
+    db.user_sessions.insert_many(
+        [{"session_token": f"s{n}", "user_id": f"u{n}", "expires_at": _iso(-7)} for n in range(100)]
+    )
+    db.verified_phones.insert_many([{"phone": f"+5255000{n:05d}"} for n in range(100)])
+
+    statuses = ["pending", "completed", "rejected"]
+    for collection in ["purchase_requests", "out_of_stock_requests", "custom_requests"]:
+        requests = []
+        for n in range(REQUEST_COUNT):
+            product = products[n % PRODUCT_COUNT]
+            requests.append({
+                "id": f"{collection}-{n}",
+                "product_id": product["id"],
+                "product_name": product["name"],
+                "category": product["category"],
+                "quantity": 1,
+                "unit_price": product["price"],
+                "total_price": product["price"],
+                "phone": f"+5255000{n % 100:05d}",
+                "status": statuses[n % len(statuses)],
+                "created_at": _iso(n % 120),
+            })
+        db[collection].insert_many(requests)
+        db[f"{collection}_archive"].insert_many(
+            [{**r, "id": f"old-{r['id']}", "created_at": _iso(200 + n % 100)} for n, r in enumerate(requests)]
+        )
+
+    db.product_popularity.insert_many([
+        {
+            "product_id": f"p{n}", "requested": n % 7, "purchased": n % 3, "interest": n % 2,
+            "score": n % 7 + 3.0 * (n % 3) + 0.5 * (n % 2),
+        }
+        for n in range(PRODUCT_COUNT)
+    ])
+
+    db.related_products.insert_many([
+        {
+            "product_id": f"p{n}",
+            "related": [{"product_id": f"p{(n + step) % PRODUCT_COUNT}", "count": 9 - step} for step in range(1, 9)],
+            "computed_at": _iso(1),
+        }
+        for n in range(PRODUCT_COUNT)
+    ])
+
+    db.sales_daily.insert_many([
+        {
+            "_id": {"day": _iso(day)[:10], "product_id": f"p{p}", "status": "completed"},
+            "day": _iso(day)[:10], "product_id": f"p{p}", "status": "completed",
+            "category": CATEGORIES[p % len(CATEGORIES)], "revenue": 10.0, "units": 1, "requests": 1,
+        }
+        for day in range(120) for p in range(10)
+    ])
+
+# ==================== CASES ====================
+
+# (name, coroutine run against the repository, max docs examined per result or None)
+CASES = [
+    ("catalog", lambda repo: repo.list_products(dict(VISIBLE_PRODUCTS)), 1.5),
+    ("catalog_admin", lambda repo: repo.list_products({}), 1.0),
+    ("catalog_category", lambda repo: repo.list_products({**VISIBLE_PRODUCTS, "category": "collares"}), 1.5),
+    ("product", lambda repo: repo.get_product("p42"), 1.0),
+    ("product_stock", lambda repo: repo.get_product("p42", PRODUCT_STOCK_PROJECTION, primary=True), 1.0),
+    ("products_batch", lambda repo: repo.get_products_by_ids([f"p{n}" for n in range(0, 100, 5)]), 1.0),
+    # Aggregates every visible product by design: only the access path is checked
+    ("category_facets", lambda repo: repo.category_facets(), None),
+    ("max_rank", lambda repo: repo.max_rank(), 1.0),
+    ("neighbor_rank", lambda repo: repo.neighbor_rank(ranking.spaced_ranks(PRODUCT_COUNT)[150], "p150", True), 2.0),
+    ("catalog_changes", lambda repo: catalog_versions.changes_since(repo, PRODUCT_COUNT - 50, False), 1.0),
+    ("catalog_changes_admin", lambda repo: catalog_versions.changes_since(repo, PRODUCT_COUNT - 50, True), 1.0),
+    ("session", lambda repo: repo.get_session("s7"), 1.0),
+    ("user_by_id", lambda repo: repo.get_user({"id": "u7"}), 1.0),
+    ("user_by_email", lambda repo: repo.get_user({"email": "user7@example.com"}), 1.0),
+    ("verified_phone", lambda repo: repo.find_one(repo.verified_phones, {"phone": "+525500000007"}), 1.0),
+    # Same filter as index.transition_request
+    ("request_transition", lambda repo: repo.purchase_requests.find_one_and_update(
+        {"id": "purchase_requests-0", "status": {"$in": ["pending"]}}, {"$set": {"status": "completed"}}
+    ), None),
+    ("back_in_stock", lambda repo: BackInStockNotifier(repo).notify("p7"), None),
+    ("stock_reserve", lambda repo: stock.reserve(repo, [{"product_id": "p3", "quantity": 1}]), None),
+    ("stale_holds", lambda repo: reaper.release_stale_holds(repo), None),
+    ("archiver", lambda repo: archiver.run_archiver(repo, days=90), 1.0),
+    ("archive_page", lambda repo: archiver.query_archive(repo, "purchase"), 1.0),
+    ("archive_by_status", lambda repo: archiver.query_archive(repo, "purchase", status="completed"), 1.0),
+    ("archive_by_range", lambda repo: archiver.query_archive(
+        repo, "custom", start=_iso(260), end=_iso(240)
+    ), 1.0),
+    ("related_products", lambda repo: repo.related_products_of("p7"), 1.0),
+    ("popular_ids", lambda repo: popularity.ranked_ids(repo), 1.0),
+    ("popularity_increment", lambda repo: popularity.record_requested(repo, {"product_id": "p5", "quantity": 2}), None),
+    ("popularity_decay", lambda repo: popularity.apply_decay(repo, 0.9), None),
+    ("popularity_decay_claim", lambda repo: popularity.decay(repo), None),
+    ("analytics", lambda repo: analytics.query(repo, "product", start=_iso(30)[:10], end=_iso(0)[:10]), None),
+]
+
+@pytest.mark.parametrize("name,run,max_ratio", CASES, ids=[case[0] for case in CASES])
+def test_query_plan(env, loop, name, run, max_ratio):
+    recorder = env["recorder"]
+    recorder.commands = []
+    try:
+        loop.run_until_complete(run(env["repo"]))
+    finally:
+        commands, recorder.commands = recorder.commands, None
+    assert commands, f"{name} sent no explainable commands"
+
+    failures = []
+    for command_name, command in commands:
+        for statement in _statements(command_name, command):
+            explain = env["db"].command({"explain": statement, "verbosity": "executionStats"})
+            problems = plan_problems(explain, command_name, max_ratio)
+            if problems:
+                failures.append(f"{command_name} {statement}: {', '.join(problems)}")
+    assert not failures, "\n".join(failures)